@@ -0,0 +1,78 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+from food.models import Ingredient
+
+
+def normalize(value):
+    """Приводит название к виду для сравнения без учёта регистра и ё."""
+    return value.strip().casefold().replace('ё', 'е')
+
+
+class IngredientIndex:
+    """Отсортированный индекс названий ингредиентов в памяти процесса.
+
+    Поиск по префиксу — двоичный поиск по отсортированным ключам, поэтому
+    не зависит от размера каталога. Индекс перестраивается лениво: после
+    сигнала об изменении ингредиентов или по истечении
+    INGREDIENT_INDEX_TTL, чтобы подхватывать изменения из других
+    процессов.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index = ([], [])
+        self._built_at = None
+
+    def invalidate(self):
+        self._built_at = None
+
+    def _is_fresh(self):
+        return self._built_at is not None and (
+            time.monotonic() - self._built_at
+            < settings.INGREDIENT_INDEX_TTL)
+
+    def _get_index(self):
+        if not self._is_fresh():
+            with self._lock:
+                if not self._is_fresh():
+                    built_at = time.monotonic()
+                    rows = sorted(
+                        (normalize(name), name, measurement_unit, pk)
+                        for pk, name, measurement_unit
+                        in Ingredient.objects.values_list(
+                            'pk', 'name', 'measurement_unit').iterator()
+                    )
+                    self._index = (
+                        [row[0] for row in rows],
+                        [row[1:] for row in rows],
+                    )
+                    self._built_at = built_at
+        return self._index
+
+    def search(self, prefix, limit=None):
+        """Ингредиенты, название которых начинается с prefix.
+
+        Точные совпадения идут первыми, остальные — по алфавиту.
+        """
+        keys, items = self._get_index()
+        prefix = normalize(prefix)
+        start = bisect_left(keys, prefix)
+        result = []
+        for position in range(start, len(keys)):
+            if not keys[position].startswith(prefix) or (
+                    limit is not None and len(result) >= limit):
+                break
+            name, measurement_unit, pk = items[position]
+            result.append({
+                'id': pk,
+                'name': name,
+                'measurement_unit': measurement_unit,
+            })
+        return result
+
+
+ingredient_index = IngredientIndex()
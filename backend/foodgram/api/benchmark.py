@@ -0,0 +1,335 @@
+"""Сценарии и замеры для команды benchmark.
+
+Запросы идут через тестовый клиент Django по настоящим адресам API, то
+есть через весь стек middleware, аутентификацию, фильтры и сериализаторы,
+но без сети и веб-сервера. measure_http нагружает запущенный сервер,
+чтобы сравнивать настройки развёртывания.
+"""
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, urlencode, urlsplit
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.db import connection
+
+from rest_framework.pagination import Cursor
+
+from .filters import ORDERINGS
+from .metrics import RequestMetrics
+from .pagination import RecipeCursorPagination
+from food.models import Recipe
+
+Scenario = namedtuple('Scenario', ('name', 'method', 'path', 'params'))
+
+PAGE_SIZE = 6
+# Далёкая страница ленты: OFFSET растёт с номером, курсор — нет.
+DEEP_PAGE = 1000
+# Тяжёлые модули, которые не должны загружаться при старте процесса.
+LAZY_MODULES = ('weasyprint',)
+STARTUP_CODE = '''
+import json, resource, sys, time
+started = time.perf_counter()
+import django
+django.setup()
+from django.urls import resolve
+resolve('/api/recipes/')
+print(json.dumps({
+    'seconds': time.perf_counter() - started,
+    'max_rss_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'eager_modules': [name for name in %r if name in sys.modules],
+}))
+''' % (LAZY_MODULES,)
+
+
+def percentile(values, share):
+    """Процентиль методом ближайшего ранга."""
+    values = sorted(values)
+    return values[max(round(share * len(values)) - 1, 0)]
+
+
+def get_rss_mib():
+    """Текущий RSS процесса, где /proc недоступен — пиковый."""
+    try:
+        with open('/proc/self/statm') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def send(client, scenario, data=None):
+    method = getattr(client, scenario.method)
+    if data is None:
+        return method(scenario.path, scenario.params)
+    return method(scenario.path, json.dumps(data),
+                  content_type='application/json')
+
+
+def measure(client, scenario, iterations, warmup=0, get_data=None):
+    """Выполняет сценарий и возвращает задержки, число SQL-запросов
+    и коды ответов. get_data(номер) строит тело запроса на запись."""
+    durations = []
+    queries = []
+    db_times = []
+    statuses = {}
+    for number in range(warmup + iterations):
+        recorder = RequestMetrics()
+        data = get_data(number) if get_data else None
+        with connection.execute_wrapper(recorder):
+            started = time.perf_counter()
+            response = send(client, scenario, data)
+            # Потоковые ответы формируются при чтении.
+            response.getvalue()
+            duration = time.perf_counter() - started
+        if number < warmup:
+            continue
+        durations.append(duration)
+        queries.append(len(recorder.queries))
+        db_times.append(recorder.db_time)
+        statuses[response.status_code] = (
+            statuses.get(response.status_code, 0) + 1)
+    return {
+        'name': scenario.name,
+        'path': scenario.path,
+        'params': scenario.params,
+        'iterations': iterations,
+        'p50_ms': percentile(durations, 0.5) * 1000,
+        'p99_ms': percentile(durations, 0.99) * 1000,
+        'max_ms': max(durations) * 1000,
+        'queries_p50': percentile(queries, 0.5),
+        'queries_max': max(queries),
+        'db_p50_ms': percentile(db_times, 0.5) * 1000,
+        'statuses': statuses,
+        'rss_mib': get_rss_mib(),
+    }
+
+
+def measure_http(base_url, token, scenario, iterations, concurrency):
+    """Отправляет iterations запросов сценария на запущенный сервер
+    в concurrency потоков и возвращает пропускную способность и
+    задержки."""
+    url = base_url.rstrip('/') + scenario.path
+    if scenario.params:
+        url += '?' + urlencode(scenario.params)
+
+    def fetch(_):
+        request = Request(url, headers={'Authorization': f'Token {token}'})
+        started = time.perf_counter()
+        try:
+            with urlopen(request) as response:
+                response.read()
+                status = response.status
+        except HTTPError as error:
+            status = error.code
+        return time.perf_counter() - started, status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fetch, range(iterations)))
+    elapsed = time.perf_counter() - started
+    durations = [duration for duration, _ in results]
+    statuses = {}
+    for _, status in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    return {
+        'name': scenario.name,
+        'path': scenario.path,
+        'params': scenario.params,
+        'iterations': iterations,
+        'concurrency': concurrency,
+        'throughput_rps': iterations / elapsed,
+        'p50_ms': percentile(durations, 0.5) * 1000,
+        'p99_ms': percentile(durations, 0.99) * 1000,
+        'max_ms': max(durations) * 1000,
+        'statuses': statuses,
+    }
+
+
+def get_deep_page(total):
+    """DEEP_PAGE или последняя страница, если рецептов меньше."""
+    return max(min(DEEP_PAGE, (total - 1) // PAGE_SIZE + 1), 1)
+
+
+def get_cursor(page):
+    """Курсор RecipeCursorPagination, с которого начинается страница
+    page, или None для первой."""
+    if page <= 1:
+        return None
+    previous = Recipe.objects.order_by(
+        *RecipeCursorPagination.ordering)[(page - 1) * PAGE_SIZE - 1]
+    paginator = RecipeCursorPagination()
+    paginator.base_url = '/'
+    url = paginator.encode_cursor(Cursor(
+        offset=0, reverse=False, position=str(previous.pub_date)))
+    return parse_qs(urlsplit(url).query)[paginator.cursor_query_param][0]
+
+
+def get_recipe_scenarios(author_id, tag_slug, search, total):
+    """Лента рецептов со всеми сочетаниями фильтров RecipeFilter,
+    каждой сортировкой и обоими видами пагинации."""
+    filters = {
+        'author': author_id,
+        'tags': tag_slug,
+        'is_favorited': 1,
+        'is_in_shopping_cart': 1,
+        'search': search,
+    }
+    scenarios = []
+    for size in range(len(filters) + 1):
+        for names in combinations(filters, size):
+            scenarios.append(Scenario(
+                'recipes' + ''.join(f'?{name}' for name in names),
+                'get', '/api/recipes/',
+                {name: filters[name] for name in names}))
+    for ordering in ORDERINGS:
+        scenarios.append(Scenario(
+            f'recipes?ordering={ordering}', 'get', '/api/recipes/',
+            {'ordering': ordering}))
+    scenarios.append(Scenario(
+        'recipes?page=middle', 'get', '/api/recipes/',
+        {'page': max(total // PAGE_SIZE // 2, 1)}))
+    scenarios.append(Scenario(
+        'recipes?pagination=cursor', 'get', '/api/recipes/',
+        {'pagination': 'cursor'}))
+    deep_page = get_deep_page(total)
+    scenarios.append(Scenario(
+        f'recipes?page={DEEP_PAGE}', 'get', '/api/recipes/',
+        {'page': deep_page}))
+    cursor = get_cursor(deep_page)
+    scenarios.append(Scenario(
+        f'recipes?pagination=cursor&page={DEEP_PAGE}', 'get',
+        '/api/recipes/',
+        {'pagination': 'cursor', **({'cursor': cursor} if cursor else {})}))
+    return scenarios
+
+
+def get_read_scenarios(recipe, tag_slug, total):
+    search = max(recipe.name.split(), key=len)
+    ingredient_ids = list(recipe.ingredients.values_list('id', flat=True))
+    ingredient = recipe.ingredients.first()
+    scenarios = get_recipe_scenarios(
+        recipe.author_id, tag_slug, search, total)
+    scenarios += [
+        Scenario('recipes/<id>', 'get', f'/api/recipes/{recipe.id}/', {}),
+        Scenario('recipes/pantry', 'get', '/api/recipes/pantry/',
+                 {'ingredients': ','.join(map(str, ingredient_ids))}),
+        Scenario('recipes/feed', 'get', '/api/recipes/feed/', {}),
+        Scenario('recipes/feed?pagination=cursor', 'get',
+                 '/api/recipes/feed/', {'pagination': 'cursor'}),
+        Scenario('users/subscriptions', 'get', '/api/users/subscriptions/',
+                 {}),
+        Scenario('users/subscriptions?recipes_limit=3', 'get',
+                 '/api/users/subscriptions/', {'recipes_limit': 3}),
+        Scenario('users/subscriptions?pagination=cursor', 'get',
+                 '/api/users/subscriptions/', {'pagination': 'cursor'}),
+    ]
+    for file_format in ('pdf', 'txt', 'csv', 'json'):
+        scenarios.append(Scenario(
+            f'download_shopping_cart?format={file_format}', 'get',
+            '/api/recipes/download_shopping_cart/',
+            {'format': file_format}))
+    if ingredient is not None:
+        prefix = ingredient.name[:3]
+        scenarios += [
+            Scenario('ingredients?name', 'get', '/api/ingredients/',
+                     {'name': prefix}),
+            Scenario('ingredients/autocomplete', 'get',
+                     '/api/ingredients/autocomplete/', {'name': prefix}),
+        ]
+    return scenarios
+
+
+def get_subscription_scenarios(authors):
+    """Подписки пользователя на authors авторов и пользователя без
+    подписок, с recipes_limit и без."""
+    scenarios = []
+    for name in (f'{authors}_authors', 'empty'):
+        path = '/api/users/subscriptions/'
+        scenarios += [
+            Scenario(f'users/subscriptions:{name}', 'get', path, {}),
+            Scenario(f'users/subscriptions:{name}?recipes_limit=3', 'get',
+                     path, {'page': 1, 'limit': PAGE_SIZE,
+                            'recipes_limit': 3}),
+        ]
+    return scenarios
+
+
+def get_recipe_data(ingredient_ids, tag_ids, number):
+    """Тело запроса на создание или изменение рецепта. От итерации к
+    итерации меняется количество одного ингредиента."""
+    return {
+        'name': 'Рецепт для замеров',
+        'text': 'Описание',
+        'cooking_time': 10,
+        'tags': tag_ids,
+        'ingredients': [
+            {'id': ingredient_id,
+             'amount': 1 + (number if index == 0 else 0)}
+            for index, ingredient_id in enumerate(ingredient_ids)
+        ],
+    }
+
+
+def measure_startup(runs):
+    """Время холодного импорта проекта и пиковый RSS отдельного
+    процесса: django.setup() и загрузка адресов API. eager_modules —
+    модули из LAZY_MODULES, загруженные при старте."""
+    results = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', STARTUP_CODE], cwd=settings.BASE_DIR,
+            check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.splitlines()[-1]))
+    return {
+        'runs': runs,
+        'seconds_p50': percentile([run['seconds'] for run in results], 0.5),
+        'max_rss_mib_p50': percentile(
+            [run['max_rss_mib'] for run in results], 0.5),
+        'eager_modules': results[0]['eager_modules'],
+    }
+
+
+def find_regressions(results, baseline, threshold):
+    """Сценарии, где p50 вырос больше чем на threshold процентов или
+    выросло число SQL-запросов по сравнению с прошлым отчётом."""
+    previous = {
+        scenario['name']: scenario for scenario in baseline['scenarios']}
+    regressions = []
+    for scenario in results['scenarios']:
+        old = previous.get(scenario['name'])
+        if old is None:
+            continue
+        if scenario['p50_ms'] > old['p50_ms'] * (1 + threshold / 100):
+            regressions.append(
+                f'{scenario["name"]}: p50 {old["p50_ms"]:.1f} → '
+                f'{scenario["p50_ms"]:.1f} мс')
+        if scenario.get('queries_p50', 0) > old.get(
+                'queries_p50', float('inf')):
+            regressions.append(
+                f'{scenario["name"]}: SQL-запросов {old["queries_p50"]} → '
+                f'{scenario["queries_p50"]}')
+    return regressions
+
+
+def find_startup_regressions(startup, baseline_startup, threshold):
+    """Тяжёлые модули, загруженные при старте, и рост времени старта
+    или памяти больше чем на threshold процентов."""
+    regressions = [f'при старте загружается {name}'
+                   for name in startup['eager_modules']]
+    if baseline_startup is None:
+        return regressions
+    for key, unit in (('seconds_p50', 'с'), ('max_rss_mib_p50', 'МиБ')):
+        if startup[key] > baseline_startup[key] * (1 + threshold / 100):
+            regressions.append(
+                f'старт, {key}: {baseline_startup[key]:.2f} → '
+                f'{startup[key]:.2f} {unit}')
+    return regressions
@@ -1,13 +1,138 @@
 import base64
+import binascii
+import hashlib
+import os
+from io import BytesIO
 
-from django.core.files.base import ContentFile
-from rest_framework.serializers import ImageField
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import (InMemoryUploadedFile,
+                                            TemporaryUploadedFile)
+from django.template.defaultfilters import filesizeformat
+from rest_framework.relations import (MANY_RELATION_KWARGS, ManyRelatedField,
+                                      PrimaryKeyRelatedField)
+from rest_framework.serializers import Field, ImageField, ValidationError
+
+# Кратно 4, чтобы каждый кусок base64 декодировался отдельно.
+DECODE_CHUNK_SIZE = 64 * 1024
 
 
 class Base64ImageField(ImageField):
+    """Картинка в виде data URI.
+
+    Данные декодируются по частям сразу в файл, крупные картинки не
+    держатся в памяти целиком. Имя файла — хеш содержимого.
+    """
+
     def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
-        return super().to_internal_value(data)
+        if not (isinstance(data, str) and data.startswith('data:image')):
+            return super().to_internal_value(data)
+        header, _, imgstr = data.partition(';base64,')
+        if not imgstr:
+            raise ValidationError('Ожидается картинка в base64.')
+        file = super().to_internal_value(
+            self.decode(imgstr, header.partition(':')[2]))
+        file.name = '{}.{}'.format(
+            os.path.splitext(file.name)[0], file.image.format.lower())
+        return file
+
+    def decode(self, imgstr, content_type):
+        max_size = settings.RECIPE_IMAGE_MAX_SIZE
+        size = len(imgstr) // 4 * 3
+        if size > max_size:
+            raise ValidationError(
+                f'Картинка больше {filesizeformat(max_size)}.')
+        if size > settings.FILE_UPLOAD_MAX_MEMORY_SIZE:
+            file = TemporaryUploadedFile(
+                'temp', content_type, size, None)
+        else:
+            file = InMemoryUploadedFile(
+                BytesIO(), None, 'temp', content_type, size, None)
+        digest = hashlib.sha256()
+        try:
+            for start in range(0, len(imgstr), DECODE_CHUNK_SIZE):
+                chunk = base64.b64decode(
+                    imgstr[start:start + DECODE_CHUNK_SIZE], validate=True)
+                digest.update(chunk)
+                file.write(chunk)
+        except (binascii.Error, ValueError):
+            file.close()
+            raise ValidationError('Некорректные данные картинки.')
+        file.size = file.tell()
+        file.seek(0)
+        file.name = '{}.{}'.format(
+            digest.hexdigest()[:32], content_type.split('/')[-1])
+        return file
+
+
+class SrcsetField(Field):
+    """srcset для каждого формата уменьшенных копий картинки."""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        kwargs.setdefault('source', 'image_variants')
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        request = self.context.get('request')
+        srcset = {}
+        for extension, files in variants.items():
+            urls = []
+            for width, name in files:
+                url = default_storage.url(name)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                urls.append(f'{url} {width}w')
+            srcset[extension] = ', '.join(urls)
+        return srcset
+
+
+def get_in_bulk(queryset, ids, message):
+    """Загружает объекты по id одним запросом. Если каких-то id нет,
+    сообщает обо всех сразу."""
+    objects = queryset.in_bulk(set(ids))
+    missing = [pk for pk in dict.fromkeys(ids) if pk not in objects]
+    if missing:
+        raise ValidationError(
+            message.format(ids=', '.join(map(str, missing))))
+    return objects
+
+
+class BulkManyRelatedField(ManyRelatedField):
+    default_error_messages = {
+        'does_not_exist': 'Не найдены объекты с id: {ids}.',
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        queryset = self.child_relation.get_queryset()
+        pk_field = queryset.model._meta.pk
+        ids = []
+        for item in data:
+            try:
+                if item is None or isinstance(item, bool):
+                    raise TypeError
+                ids.append(pk_field.to_python(item))
+            except (TypeError, DjangoValidationError):
+                self.child_relation.fail(
+                    'incorrect_type', data_type=type(item).__name__)
+        objects = get_in_bulk(
+            queryset, ids, self.error_messages['does_not_exist'])
+        return [objects[pk] for pk in ids]
+
+
+class BulkPrimaryKeyRelatedField(PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField, который с many=True проверяет все id одним
+    запросом."""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
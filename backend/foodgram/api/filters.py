@@ -1,19 +1,17 @@
 from django_filters.rest_framework import FilterSet
 from django_filters.rest_framework.filters import (BooleanFilter, CharFilter,
+                                                   ChoiceFilter,
                                                    ModelMultipleChoiceFilter)
 
-from food.models import Ingredient, Recipe, Tag
+from food.models import Recipe, Tag
 
-
-class IngredientSearchFilter(FilterSet):
-    name = CharFilter(
-        field_name="name",
-        lookup_expr="istartswith",
-    )
-
-    class Meta:
-        model = Ingredient
-        fields = ("name",)
+ORDERINGS = {
+    'popular': ('-favorites_count', '-id'),
+    'in_carts': ('-in_carts_count', '-id'),
+    'pub_date': ('-pub_date', '-id'),
+}
+# Порядки по счётчикам, которые меняются без сброса кэша ответов.
+COUNTER_ORDERINGS = ('popular', 'in_carts')
 
 
 class RecipeFilter(FilterSet):
@@ -25,19 +23,32 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = BooleanFilter(
         method='get_is_in_shopping_cart'
     )
+    search = CharFilter(method='get_search')
+    ordering = ChoiceFilter(
+        choices=[(name, name) for name in ORDERINGS],
+        method='get_ordering')
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+                  'search', 'ordering')
+
+    def get_search(self, queryset, name, value):
+        if not value.strip():
+            return queryset
+        return queryset.search(value.strip())
+
+    def get_ordering(self, queryset, name, value):
+        return queryset.order_by(*ORDERINGS[value])
 
     def get_is_favorited(self, queryset, name, value):
         user = self.request.user
         if value:
             return queryset.filter(favorites__user=user)
-        return Recipe.objects.all()
+        return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         user = self.request.user
         if value:
             return queryset.filter(shopping_cart__user=user)
-        return Recipe.objects.all()
+        return queryset
@@ -0,0 +1,306 @@
+import json
+import platform
+
+import django
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client, override_settings
+from rest_framework.authtoken.models import Token
+
+from api import benchmark
+from food.models import Ingredient, Recipe, Tag
+from users.models import Follow, User
+
+DUMMY_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+}
+METRICS_MIDDLEWARE = 'api.metrics.MetricsMiddleware'
+OVERHEAD_SCENARIO = 'recipes'
+OVERHEAD_ROUNDS = 3
+WRITE_INGREDIENTS = 50
+REPLACED_INGREDIENTS = 40
+SUBSCRIBED_AUTHORS = 500
+SUBSCRIBED_AUTHOR_RECIPES = 5
+
+
+class Command(BaseCommand):
+    help = ('Замеряет задержку, число SQL-запросов и память на основных '
+            'адресах API и выводит отчёт в JSON. Данные для замеров '
+            'создаёт команда generate_fake_data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument(
+            '--only', default='',
+            help='Запускать только сценарии, в имени которых есть строка.')
+        parser.add_argument(
+            '--user', type=int,
+            help='id пользователя, от имени которого идут запросы. По '
+                 'умолчанию — первый с подписками, избранным и корзиной.')
+        parser.add_argument(
+            '--cache', action='store_true',
+            help='Не отключать кэш ответов.')
+        parser.add_argument('--startup-runs', type=int, default=3)
+        parser.add_argument(
+            '--base-url',
+            help='Нагружать запущенный сервер, например '
+                 'http://localhost:8000, вместо замеров в процессе. '
+                 'Сервер должен работать с той же базой.')
+        parser.add_argument(
+            '--concurrency', type=int, default=8,
+            help='Число одновременных запросов для --base-url.')
+        parser.add_argument('--output', help='Записать отчёт в файл.')
+        parser.add_argument(
+            '--baseline',
+            help='Отчёт прошлого запуска: при регрессии команда '
+                 'завершается с ошибкой. Загрузка модулей из '
+                 'LAZY_MODULES при старте считается регрессией всегда.')
+        parser.add_argument(
+            '--threshold', type=float, default=20,
+            help='Допустимый рост p50 относительно --baseline, %%.')
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        token, _ = Token.objects.get_or_create(user=user)
+        self.client = Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.options = options
+        if options['base_url']:
+            results = {
+                'environment': self.get_environment(user),
+                'base_url': options['base_url'],
+                'scenarios': self.run_http(user, token.key),
+            }
+        else:
+            results = self.run_in_process(user)
+        report = json.dumps(results, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                output.write(report)
+        else:
+            self.stdout.write(report)
+        self.check_regressions(results)
+
+    def run_in_process(self, user):
+        caches = settings.CACHES if self.options['cache'] else DUMMY_CACHES
+        with override_settings(CACHES=caches):
+            results = {
+                'environment': self.get_environment(user),
+                'rss_mib_before': benchmark.get_rss_mib(),
+                'scenarios': (self.run_reads(user) + self.run_writes()
+                              + self.run_subscriptions()),
+            }
+            results['metrics_overhead'] = self.run_metrics_overhead()
+        results['startup'] = benchmark.measure_startup(
+            self.options['startup_runs'])
+        results['rss_mib_after'] = benchmark.get_rss_mib()
+        return results
+
+    def run_http(self, user, token):
+        """Сценарии чтения на запущенном сервере, сценарии записи
+        не выполняются."""
+        return [
+            benchmark.measure_http(
+                self.options['base_url'], token, scenario,
+                self.options['iterations'], self.options['concurrency'])
+            for scenario in self.get_read_scenarios(user)
+        ]
+
+    @staticmethod
+    def get_user(user_id):
+        users = User.objects.all()
+        if user_id is None:
+            users = users.filter(
+                follower__isnull=False, favorites_user__isnull=False,
+                shopping_cart__isnull=False)
+        else:
+            users = users.filter(pk=user_id)
+        user = users.first()
+        if user is None:
+            raise CommandError(
+                'Нет подходящего пользователя, заполните базу командой '
+                'generate_fake_data.')
+        return user
+
+    @staticmethod
+    def get_environment(user):
+        return {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'users': User.objects.count(),
+            'recipes': Recipe.objects.count(),
+            'ingredients': Ingredient.objects.count(),
+            'user': user.pk,
+        }
+
+    def is_selected(self, name):
+        return self.options['only'] in name
+
+    def run(self, scenario, client=None, **kwargs):
+        return benchmark.measure(
+            client or self.client, scenario, self.options['iterations'],
+            self.options['warmup'], **kwargs)
+
+    def get_read_scenarios(self, user):
+        recipe = (Recipe.objects.filter(shopping_cart__user=user).first()
+                  or Recipe.objects.first())
+        return [
+            scenario for scenario in benchmark.get_read_scenarios(
+                recipe, Tag.objects.values_list('slug', flat=True).first(),
+                Recipe.objects.count())
+            if self.is_selected(scenario.name)
+        ]
+
+    def run_reads(self, user):
+        return [self.run(scenario)
+                for scenario in self.get_read_scenarios(user)]
+
+    def run_writes(self):
+        """Создание и правка рецепта с WRITE_INGREDIENTS ингредиентами:
+        смена количеств и замена REPLACED_INGREDIENTS ингредиентов
+        другими. Всё, что записали сценарии, откатывается."""
+        ingredient_ids = list(Ingredient.objects.values_list(
+            'pk', flat=True)[:WRITE_INGREDIENTS + REPLACED_INGREDIENTS])
+        tag_ids = list(Tag.objects.values_list('pk', flat=True)[:2])
+        kept = ingredient_ids[:WRITE_INGREDIENTS - REPLACED_INGREDIENTS]
+        compositions = (ingredient_ids[:WRITE_INGREDIENTS],
+                        kept + ingredient_ids[WRITE_INGREDIENTS:])
+
+        def get_data(number):
+            return benchmark.get_recipe_data(
+                compositions[0], tag_ids, number)
+
+        def get_replace_data(number):
+            return benchmark.get_recipe_data(
+                compositions[(number + 1) % 2], tag_ids, 0)
+
+        create = benchmark.Scenario(
+            'recipes:create', 'post', '/api/recipes/', {})
+        updates = (
+            (benchmark.Scenario(
+                'recipes/<id>:update', 'patch', '/api/recipes/{}/', {}),
+             get_data),
+            (benchmark.Scenario(
+                'recipes/<id>:replace_ingredients', 'patch',
+                '/api/recipes/{}/', {}),
+             get_replace_data),
+        )
+        results = []
+        with transaction.atomic():
+            if self.is_selected(create.name):
+                results.append(self.run(create, get_data=get_data))
+            for update, get_update_data in updates:
+                if not self.is_selected(update.name):
+                    continue
+                response = benchmark.send(self.client, create, get_data(0))
+                results.append(self.run(
+                    update._replace(path=update.path.format(
+                        response.json()['id'])),
+                    get_data=get_update_data))
+            transaction.set_rollback(True)
+        return results
+
+    def run_subscriptions(self):
+        """Подписки на SUBSCRIBED_AUTHORS авторов и пустые подписки.
+        Недостающие авторы создаются, всё созданное откатывается."""
+        scenarios = [
+            scenario for scenario in benchmark.get_subscription_scenarios(
+                SUBSCRIBED_AUTHORS)
+            if self.is_selected(scenario.name)
+        ]
+        if not scenarios:
+            return []
+        results = []
+        with transaction.atomic():
+            subscriber = self.create_benchmark_user('subscriber')
+            Follow.objects.bulk_create(
+                Follow(user=subscriber, author_id=author_id)
+                for author_id in self.get_benchmark_authors())
+            clients = {
+                'empty': self.get_client(self.create_benchmark_user('empty')),
+                'authors': self.get_client(subscriber),
+            }
+            for scenario in scenarios:
+                client = clients['empty' if ':empty' in scenario.name
+                                 else 'authors']
+                results.append(self.run(scenario, client))
+            transaction.set_rollback(True)
+        return results
+
+    @staticmethod
+    def create_benchmark_user(name):
+        return User.objects.create(username=f'benchmark_{name}',
+                                   email=f'benchmark_{name}@foodgram.ru')
+
+    @staticmethod
+    def get_client(user):
+        token = Token.objects.create(user=user)
+        return Client(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    @staticmethod
+    def get_benchmark_authors():
+        """id SUBSCRIBED_AUTHORS авторов с рецептами, недостающие
+        создаются с SUBSCRIBED_AUTHOR_RECIPES рецептами каждый."""
+        author_ids = list(User.objects.filter(
+            recipes__isnull=False).distinct().values_list(
+            'pk', flat=True)[:SUBSCRIBED_AUTHORS])
+        missing = SUBSCRIBED_AUTHORS - len(author_ids)
+        if missing <= 0:
+            return author_ids
+        User.objects.bulk_create(
+            User(username=f'benchmark_author{number}',
+                 email=f'benchmark_author{number}@foodgram.ru',
+                 recipes_count=SUBSCRIBED_AUTHOR_RECIPES)
+            for number in range(missing))
+        created = list(User.objects.filter(
+            username__startswith='benchmark_author').values_list(
+            'pk', flat=True))
+        Recipe.objects.bulk_create(
+            Recipe(author_id=author_id, name=f'Рецепт {number}',
+                   text='Описание', cooking_time=10)
+            for author_id in created
+            for number in range(SUBSCRIBED_AUTHOR_RECIPES))
+        return author_ids + created
+
+    def run_metrics_overhead(self):
+        """Доля, которую MetricsMiddleware добавляет к p50 ленты. Замеры
+        с middleware и без чередуются, берётся лучший p50 каждого."""
+        if (METRICS_MIDDLEWARE not in settings.MIDDLEWARE
+                or not self.is_selected(OVERHEAD_SCENARIO)):
+            return None
+        scenario = benchmark.Scenario(
+            OVERHEAD_SCENARIO, 'get', '/api/recipes/', {})
+        token = self.client.defaults['HTTP_AUTHORIZATION']
+        without_middleware = override_settings(MIDDLEWARE=[
+            name for name in settings.MIDDLEWARE
+            if name != METRICS_MIDDLEWARE])
+        with_metrics = []
+        without_metrics = []
+        for _ in range(OVERHEAD_ROUNDS):
+            with_metrics.append(self.run(
+                scenario, Client(HTTP_AUTHORIZATION=token))['p50_ms'])
+            with without_middleware:
+                without_metrics.append(self.run(
+                    scenario, Client(HTTP_AUTHORIZATION=token))['p50_ms'])
+        return {
+            'p50_ms': min(with_metrics),
+            'p50_ms_without_metrics': min(without_metrics),
+            'percent': (min(with_metrics) / min(without_metrics) - 1) * 100,
+        }
+
+    def check_regressions(self, results):
+        baseline = {'scenarios': []}
+        if self.options['baseline']:
+            with open(self.options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+        regressions = benchmark.find_regressions(
+            results, baseline, self.options['threshold'])
+        if 'startup' in results:
+            regressions += benchmark.find_startup_regressions(
+                results['startup'], baseline.get('startup'),
+                self.options['threshold'])
+        if regressions:
+            raise CommandError(
+                'Регрессии производительности:\n' + '\n'.join(regressions))
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management import BaseCommand
+
+from api import snapshots
+from food.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Собирает и сохраняет устаревшие снимки представления '
+            'рецептов: запросы на чтение собирают их без сохранения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересобрать все снимки, даже свежие.')
+        parser.add_argument(
+            '--pending', action='store_true',
+            help='Собрать только снимки, помеченные после массовых '
+                 'изменений (тегов, ингредиентов, авторов).')
+        parser.add_argument(
+            '--forever', action='store_true',
+            help='С --pending: не завершаться, а ждать новых пометок.')
+        parser.add_argument(
+            '--poll-interval', type=float, default=5.0,
+            help='Пауза между проверками с --forever, сек.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options['pending']:
+            self.handle_pending(options)
+            return
+        batch_size = options['batch_size']
+        recipe_ids = list(Recipe.objects.order_by('pk').values_list(
+            'pk', flat=True))
+        count = 0
+        for start in range(0, len(recipe_ids), batch_size):
+            recipes = list(Recipe.objects.filter(
+                pk__in=recipe_ids[start:start + batch_size]))
+            if options['all']:
+                count += snapshots.rebuild(recipes)
+                continue
+            count += sum(not snapshots.is_fresh(recipe) for recipe in recipes)
+            snapshots.refresh(recipes)
+        self.stdout.write(f'Собрано снимков: {count}.')
+
+    def handle_pending(self, options):
+        while True:
+            count = 0
+            while True:
+                built = snapshots.refresh_pending(options['batch_size'])
+                if not built:
+                    break
+                count += built
+            if count or not options['forever']:
+                self.stdout.write(f'Собрано снимков: {count}.')
+            if not options['forever']:
+                return
+            time.sleep(options['poll_interval'])
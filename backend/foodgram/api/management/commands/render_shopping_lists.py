@@ -0,0 +1,82 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from api.shopping_list import render_pdf
+from food import jobs
+from food.models import ShoppingListJob
+from food.models.shopping_list import DONE, FAILED
+
+CLEANUP_INTERVAL = 60 * 60
+
+
+class Command(BaseCommand):
+    help = ('Отрисовывает списки покупок из очереди заданий в отдельном '
+            'пуле процессов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int,
+            default=settings.SHOPPING_LIST_WORKERS,
+            help='Число процессов отрисовки.')
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Пауза между опросами очереди, сек.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Обработать очередь и завершиться.')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        connections.close_all()
+        running = {}
+        cleaned_at = 0
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=django.setup) as pool:
+            while True:
+                if time.monotonic() - cleaned_at > CLEANUP_INTERVAL:
+                    self.cleanup()
+                    cleaned_at = time.monotonic()
+                for job in jobs.claim(
+                        ShoppingListJob, workers - len(running),
+                        settings.SHOPPING_LIST_JOB_TIMEOUT):
+                    running[pool.submit(render_pdf, job.items)] = job
+                if not running:
+                    if options['once']:
+                        return
+                    time.sleep(options['poll_interval'])
+                    continue
+                done, _ = wait(running, timeout=options['poll_interval'],
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.finish(running.pop(future), future)
+
+    def finish(self, job, future):
+        try:
+            pdf = future.result()
+        except Exception as error:
+            job.status = FAILED
+            job.error = repr(error)
+            self.stderr.write(f'Задание {job.pk}: {job.error}')
+        else:
+            job.file.save(f'{job.digest}.pdf', ContentFile(pdf), save=False)
+            job.status = DONE
+        job.finished = timezone.now()
+        job.save(update_fields=('status', 'file', 'error', 'finished'))
+
+    @staticmethod
+    def cleanup():
+        expired = ShoppingListJob.objects.filter(
+            created__lt=timezone.now() - timedelta(
+                seconds=settings.SHOPPING_LIST_JOB_TTL)
+        )
+        for job in expired.exclude(file=''):
+            job.file.delete(save=False)
+        expired.delete()
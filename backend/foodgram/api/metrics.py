@@ -0,0 +1,224 @@
+"""Метрики запросов: время ответа, число и время SQL-запросов и время
+сериализации по каждому обработчику.
+
+Гистограммы хранятся в памяти процесса и отдаются в текстовом формате
+Prometheus. У каждого процесса gunicorn свои значения. Медленные запросы
+пишутся в лог вместе с самыми долгими SQL-запросами, не чаще раза в
+SLOW_REQUEST_LOG_INTERVAL секунд для одного обработчика.
+"""
+import hmac
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+from django.http import Http404, HttpResponse
+from rest_framework.serializers import ListSerializer, Serializer
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+SLOW_REQUEST_QUERIES = 10
+
+METRICS = (
+    ('request_duration_seconds', 'Время обработки запроса.',
+     DURATION_BUCKETS),
+    ('db_queries', 'Число SQL-запросов на запрос.', QUERY_BUCKETS),
+    ('db_duration_seconds', 'Время SQL-запросов на запрос.',
+     DURATION_BUCKETS),
+    ('serializer_duration_seconds', 'Время сериализации на запрос.',
+     DURATION_BUCKETS),
+)
+
+logger = logging.getLogger(__name__)
+
+current_request = ContextVar('current_request', default=None)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.responses = {}
+        self.slow_logged = {}
+
+    def observe(self, view, method, status, values):
+        with self.lock:
+            for name, _, buckets in METRICS:
+                key = (name, view, method)
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    histogram = self.histograms[key] = Histogram(buckets)
+                histogram.observe(values[name])
+            key = (view, method, status)
+            self.responses[key] = self.responses.get(key, 0) + 1
+
+    def should_log_slow(self, view):
+        now = time.monotonic()
+        with self.lock:
+            if now - self.slow_logged.get(view, -float('inf')) < (
+                    settings.SLOW_REQUEST_LOG_INTERVAL):
+                return False
+            self.slow_logged[view] = now
+        return True
+
+    def export(self):
+        """Метрики в текстовом формате Prometheus."""
+        with self.lock:
+            histograms = sorted(
+                (key, list(histogram.counts), histogram.sum, histogram.count)
+                for key, histogram in self.histograms.items())
+            responses = sorted(self.responses.items())
+        lines = [
+            '# HELP foodgram_responses_total Число ответов.',
+            '# TYPE foodgram_responses_total counter',
+        ]
+        for (view, method, status), count in responses:
+            lines.append(
+                f'foodgram_responses_total{{view="{view}",'
+                f'method="{method}",status="{status}"}} {count}')
+        for name, description, buckets in METRICS:
+            lines.append(f'# HELP foodgram_{name} {description}')
+            lines.append(f'# TYPE foodgram_{name} histogram')
+            for (metric, view, method), counts, total, count in histograms:
+                if metric != name:
+                    continue
+                labels = f'view="{view}",method="{method}"'
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f'foodgram_{name}_bucket'
+                                 f'{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(
+                    f'foodgram_{name}_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f'foodgram_{name}_sum{{{labels}}} {total}')
+                lines.append(f'foodgram_{name}_count{{{labels}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+class RequestMetrics:
+    __slots__ = ('queries', 'db_time', 'serializer_time', 'serializer_depth')
+
+    def __init__(self):
+        self.queries = []
+        self.db_time = 0
+        self.serializer_time = 0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.db_time += duration
+            self.queries.append((duration, sql))
+
+
+def timed_data(data):
+    """Оборачивает свойство data сериализатора. Время считается только
+    для внешнего сериализатора, вложенные в него не учитываются."""
+    getter = data.fget
+
+    def get_data(self):
+        metrics = current_request.get()
+        if metrics is None:
+            return getter(self)
+        metrics.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return getter(self)
+        finally:
+            metrics.serializer_depth -= 1
+            if not metrics.serializer_depth:
+                metrics.serializer_time += time.perf_counter() - started
+
+    get_data.timed = True
+    return property(get_data)
+
+
+def instrument_serializers():
+    for serializer_class in (Serializer, ListSerializer):
+        if not getattr(serializer_class.data.fget, 'timed', False):
+            serializer_class.data = timed_data(serializer_class.data)
+
+
+class MetricsMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        instrument_serializers()
+
+    def __call__(self, request):
+        metrics = RequestMetrics()
+        token = current_request.set(metrics)
+        wrappers = [
+            connection.execute_wrapper(metrics)
+            for connection in connections.all()
+        ]
+        started = time.perf_counter()
+        try:
+            for wrapper in wrappers:
+                wrapper.__enter__()
+            response = self.get_response(request)
+        finally:
+            for wrapper in reversed(wrappers):
+                wrapper.__exit__(None, None, None)
+            current_request.reset(token)
+        duration = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        registry.observe(view, request.method, response.status_code, {
+            'request_duration_seconds': duration,
+            'db_queries': len(metrics.queries),
+            'db_duration_seconds': metrics.db_time,
+            'serializer_duration_seconds': metrics.serializer_time,
+        })
+        if (duration * 1000 >= settings.SLOW_REQUEST_THRESHOLD
+                and registry.should_log_slow(view)):
+            self.log_slow_request(request, view, duration, metrics)
+        return response
+
+    @staticmethod
+    def log_slow_request(request, view, duration, metrics):
+        queries = sorted(metrics.queries, reverse=True)[:SLOW_REQUEST_QUERIES]
+        logger.warning(
+            'Медленный запрос %s %s (%s): %.0f мс, SQL: %d запросов за '
+            '%.0f мс, сериализация %.0f мс\n%s',
+            request.method, request.get_full_path(), view, duration * 1000,
+            len(metrics.queries), metrics.db_time * 1000,
+            metrics.serializer_time * 1000,
+            '\n'.join(f'{query_time * 1000:.1f} мс: {sql}'
+                      for query_time, sql in queries),
+        )
+
+
+def metrics_view(request):
+    """Метрики для Prometheus. Без METRICS_TOKEN адрес недоступен."""
+    token = settings.METRICS_TOKEN
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    if not token or not hmac.compare_digest(header, f'Bearer {token}'):
+        raise Http404
+    return HttpResponse(
+        registry.export(), content_type='text/plain; version=0.0.4')
@@ -1,6 +1,53 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class CustomPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     page_size = 6
+
+
+class RecipeCursorPagination(CursorPagination):
+    """Пагинация по ключу (pub_date, id) без COUNT(*) и OFFSET."""
+    page_size_query_param = 'limit'
+    page_size = 6
+    ordering = ('-pub_date', '-id')
+
+
+class FeedCursorPagination(CursorPagination):
+    """Ленту курсор листает по индексу записей ленты (user, pub_date,
+    recipe)."""
+    page_size_query_param = 'limit'
+    page_size = 6
+    ordering = ('-pub_date', '-recipe_id')
+
+
+class UserCursorPagination(CursorPagination):
+    page_size_query_param = 'limit'
+    page_size = 6
+    ordering = ('id',)
+
+
+class CursorPaginationMixin:
+    """Включает курсорную пагинацию по параметру ?pagination=cursor,
+    по умолчанию остаётся постраничная.
+
+    Курсор листает queryset в порядке cursor_pagination_class.ordering,
+    поэтому доступен только действиям из cursor_actions, а запросы с
+    другим порядком отклоняются в check_cursor_pagination.
+    """
+    cursor_pagination_class = None
+    cursor_actions = ('list',)
+
+    def check_cursor_pagination(self):
+        if self.action not in self.cursor_actions:
+            raise ValidationError({'pagination': (
+                'Курсорная пагинация для этого адреса недоступна.')})
+
+    @property
+    def paginator(self):
+        if (not hasattr(self, '_paginator')
+                and self.request.query_params.get('pagination') == 'cursor'):
+            self.check_cursor_pagination()
+            self._paginator = self.cursor_pagination_class()
+        return super().paginator
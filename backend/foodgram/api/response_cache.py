@@ -0,0 +1,108 @@
+"""Кэш ответов API на чтение.
+
+Ключ ответа строится из пути, параметров запроса, пользователя и
+текущих версий: общей версии раздела (рецепты, теги, ингредиенты) и
+личной версии пользователя. Сигналы моделей меняют версии, после чего
+старые ключи больше не запрашиваются и вытесняются из кэша сами.
+
+Счётчики рецептов меняются без смены версий, поэтому в ответ из кэша
+они читаются из базы, а списки по ним не кэшируются.
+
+Версии меняются только в кэше того процесса, который записал данные.
+Если кэш не общий для процессов gunicorn (locmem), ответы
+пользователям с избранным, корзиной и подписками не кэшируются, а
+ответы гостям устаревают не дольше чем на RESPONSE_CACHE_TIMEOUT.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from rest_framework.response import Response
+
+RECIPES = 'recipes'
+TAGS = 'tags'
+INGREDIENTS = 'ingredients'
+
+SCOPE_VERSION_KEY = 'response_version:{}'
+USER_VERSION_KEY = 'response_version:user:{}'
+
+# Бэкенды, у которых в каждом процессе свой кэш.
+PER_PROCESS_BACKENDS = (LocMemCache, DummyCache)
+
+
+def is_shared():
+    """Общий ли кэш для всех процессов."""
+    return not isinstance(caches['default'], PER_PROCESS_BACKENDS)
+
+
+def get_versions(keys):
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        for key, version in missing.items():
+            cache.add(key, version, None)
+        versions.update(cache.get_many(list(missing)))
+    return [versions.get(key, '') for key in keys]
+
+
+def bump(*scopes, user_ids=()):
+    """Меняет версии после фиксации транзакции, чтобы параллельный
+    запрос не закэшировал ответ по незафиксированным данным."""
+    keys = [SCOPE_VERSION_KEY.format(scope) for scope in scopes] + [
+        USER_VERSION_KEY.format(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.set_many(
+        {key: uuid.uuid4().hex for key in keys}, None))
+
+
+def get_key(request, scope):
+    user = request.user
+    keys = [SCOPE_VERSION_KEY.format(scope)]
+    if user.is_authenticated:
+        keys.append(USER_VERSION_KEY.format(user.id))
+    parts = [
+        request.path,
+        sorted(request.query_params.lists()),
+        user.id if user.is_authenticated else 'anonymous',
+        get_versions(keys),
+    ]
+    return 'response:' + hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+class CachedResponseMixin:
+    """Кэширует успешные ответы list и retrieve.
+
+    Данные, которые меняются без смены версий, в кэше устаревают:
+    is_cacheable отключает кэш для таких запросов, а update_cached_data
+    дописывает их к ответу из кэша.
+    """
+    cache_scope = None
+
+    def is_cacheable(self, request):
+        return not request.user.is_authenticated or is_shared()
+
+    def update_cached_data(self, data):
+        return data
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        if not self.is_cacheable(request):
+            return handler(request, *args, **kwargs)
+        key = get_key(request, self.cache_scope)
+        data = cache.get(key)
+        if data is not None:
+            return Response(self.update_cached_data(data))
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(key, response.data, settings.RESPONSE_CACHE_TIMEOUT)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs)
@@ -1,6 +1,9 @@
 import webcolors
+from django.conf import settings
 from django.contrib.auth.hashers import make_password
+from django.db import transaction
 from django.shortcuts import get_object_or_404
+from django.urls import reverse
 from djoser.serializers import UserSerializer
 from rest_framework import serializers
 from rest_framework.serializers import (IntegerField, ModelSerializer,
@@ -8,10 +11,14 @@ from rest_framework.serializers import (IntegerField, ModelSerializer,
                                         SerializerMethodField,
                                         SlugRelatedField, ValidationError)
 
-from .fields import Base64ImageField
+from . import response_cache, shopping_list, user_flags
+from .fields import (Base64ImageField, BulkPrimaryKeyRelatedField,
+                     SrcsetField, get_in_bulk)
+from food import counters, images, pantry, shopping_list_items, timeline
 from users.models import Follow, User
 from food.models import (Cart, Favorite, Ingredient, IngredientRecipe, Recipe,
-                         Tag)
+                         ShoppingListJob, Tag)
+from food.models.shopping_list import DONE
 
 
 class Hex2NameColor(serializers.Field):
@@ -54,11 +61,8 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj: User):
-        request = self.context.get('request')
-        if not request or request.user.is_anonymous:
-            return False
-        return Follow.objects.filter(
-            user=request.user, author=obj).exists()
+        flags = user_flags.get_for_request(self.context.get('request'))
+        return flags is not None and obj.id in flags.follows
 
 
 class CustomRegUserSerializer(UserSerializer):
@@ -117,6 +121,7 @@ class ShowRecipeSerializer(serializers.ModelSerializer):
     author = CustomUserSerializer(read_only=True)
     ingredients = serializers.SerializerMethodField()
     image = Base64ImageField()
+    srcset = SrcsetField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -141,9 +146,23 @@ class ShowRecipeSerializer(serializers.ModelSerializer):
         return IngredientRecipeSerializer(ingredients, many=True).data
 
 
+class IngredientRecipeListSerializer(serializers.ListSerializer):
+    """Проверяет id всех ингредиентов рецепта одним запросом."""
+
+    def to_internal_value(self, data):
+        ingredients = super().to_internal_value(data)
+        objects = get_in_bulk(
+            Ingredient.objects.all(),
+            [ingredient['id'] for ingredient in ingredients],
+            'Не найдены ингредиенты с id: {ids}.',
+        )
+        for ingredient in ingredients:
+            ingredient['id'] = objects[ingredient['id']]
+        return ingredients
+
+
 class CreateIngredientRecipeSerializer(ModelSerializer):
-    id = PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all())
+    id = IntegerField()
 
     class Meta:
         model = IngredientRecipe
@@ -151,6 +170,7 @@ class CreateIngredientRecipeSerializer(ModelSerializer):
             'id',
             'amount',
         )
+        list_serializer_class = IngredientRecipeListSerializer
 
     def validate_amount(self, value):
         if int(value) < 1:
@@ -173,6 +193,7 @@ class RecipeSerializer(serializers.ModelSerializer):
         source='ingridients_recipe')
     tags = TagsSerializer(read_only=True, many=True)
     image = Base64ImageField()
+    srcset = SrcsetField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -183,37 +204,32 @@ class RecipeSerializer(serializers.ModelSerializer):
             'author',
             'name',
             'image',
+            'srcset',
             'text',
             'ingredients',
             'pub_date',
             'tags',
             'cooking_time',
             'is_in_shopping_cart',
-            'is_favorited'
+            'is_favorited',
+            'favorites_count',
+            'in_carts_count'
         )
 
     def get_is_favorited(self, obj):
-        request = self.context.get("request")
-        if not request or request.user.is_anonymous:
-            return False
-        return Favorite.objects.filter(
-            recipe=obj, user=request.user
-        ).exists()
+        flags = user_flags.get_for_request(self.context.get('request'))
+        return flags is not None and obj.id in flags.favorites
 
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get("request")
-        if not request or request.user.is_anonymous:
-            return False
-        return Cart.objects.filter(
-            recipe=obj, user=request.user
-        ).exists()
+        flags = user_flags.get_for_request(self.context.get('request'))
+        return flags is not None and obj.id in flags.cart
 
 
 class CreateRecipeSerializer(serializers.ModelSerializer):
     image = Base64ImageField(required=False, allow_null=True)
     author = CustomUserSerializer(read_only=True)
     ingredients = CreateIngredientRecipeSerializer(many=True)
-    tags = PrimaryKeyRelatedField(queryset=Tag.objects.all(), many=True)
+    tags = BulkPrimaryKeyRelatedField(queryset=Tag.objects.all(), many=True)
     cooking_time = IntegerField()
 
     class Meta:
@@ -229,6 +245,15 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
             'author'
         )
 
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            image = self.validated_data.get('image')
+            if image:
+                # Временный файл декодированной картинки.
+                image.close()
+
     def create_ingredients(self, recipe, ingredients):
         IngredientRecipe.objects.bulk_create([
             IngredientRecipe(
@@ -273,20 +298,89 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
         request = self.context.get('request')
         ingredients = validate_data.pop('ingredients')
         tags = validate_data.pop('tags')
-        recipe = Recipe.objects.create(
-            author=request.user,
-            **validate_data
-        )
-        self.create_ingredients(recipe, ingredients)
-        recipe.tags.set(tags)
+        with transaction.atomic():
+            recipe = Recipe.objects.create(
+                author=request.user,
+                **validate_data
+            )
+            self.create_ingredients(recipe, ingredients)
+            pantry.update_recipe(
+                recipe, [ingredient['id'].id for ingredient in ingredients])
+            recipe.tags.set(tags)
+            counters.change_author(request.user.id, 1)
+            timeline.push(recipe)
+            if recipe.image:
+                images.schedule(recipe.id)
         return recipe
 
+    def update_ingredients(self, recipe, ingredients):
+        """Применяет к составу рецепта только изменения: добавляет новые
+        строки, меняет количество и удаляет исключённые ингредиенты."""
+        existing = {
+            row.ingredient_id: row
+            for row in IngredientRecipe.objects.filter(recipe=recipe)
+        }
+        amounts = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients
+        }
+        old_amounts = {
+            ingredient_id: row.amount
+            for ingredient_id, row in existing.items()
+        }
+        changed = []
+        for ingredient_id, amount in amounts.items():
+            row = existing.get(ingredient_id)
+            if row is not None and row.amount != amount:
+                row.amount = amount
+                changed.append(row)
+        removed = [
+            row.pk for ingredient_id, row in existing.items()
+            if ingredient_id not in amounts
+        ]
+        added = [
+            ingredient for ingredient in ingredients
+            if ingredient['id'].id not in existing
+        ]
+        if removed:
+            # Без сигналов post_delete на каждую строку: кэши, снимок и
+            # списки покупок рецепта обновляет update() один раз.
+            removed_rows = IngredientRecipe.objects.filter(pk__in=removed)
+            removed_rows._raw_delete(removed_rows.db)
+        IngredientRecipe.objects.bulk_update(changed, ('amount',))
+        self.create_ingredients(recipe, added)
+        if removed or added:
+            pantry.update_recipe(recipe, amounts.keys())
+        if removed or added or changed:
+            shopping_list_items.change_recipe(
+                recipe.id, old_amounts, amounts)
+        return bool(removed or added or changed)
+
     def update(self, instance, validated_data):
         ingredients = validated_data.pop('ingredients')
+        tags = validated_data.pop('tags')
         recipe = instance
-        IngredientRecipe.objects.filter(recipe=recipe).delete()
-        self.create_ingredients(recipe, ingredients)
-        return super().update(recipe, validated_data)
+        old_image = recipe.image.name
+        with transaction.atomic():
+            # Состав читается под блокировкой рецепта, иначе два
+            # одновременных изменения посчитают приращения списков покупок
+            # от одного и того же состава.
+            Recipe.objects.select_for_update().get(pk=recipe.pk)
+            if self.update_ingredients(recipe, ingredients):
+                # Массовые операции не отправляют сигналы.
+                user_ids = list(Cart.objects.filter(
+                    recipe=recipe).values_list('user_id', flat=True))
+                transaction.on_commit(
+                    lambda: shopping_list.invalidate(user_ids))
+                response_cache.bump(response_cache.RECIPES)
+            recipe.tags.set(tags)
+            recipe = super().update(recipe, validated_data)
+            if recipe.image.name != old_image:
+                recipe.image_variants = {}
+                recipe.save(update_fields=('image_variants',))
+                if recipe.image:
+                    images.schedule(recipe.id)
+        return recipe
 
 
 class FollowSerializer(serializers.ModelSerializer):
@@ -312,16 +406,24 @@ class FollowSerializer(serializers.ModelSerializer):
             })
         return data
 
+    def create(self, validated_data):
+        with transaction.atomic():
+            instance = super().create(validated_data)
+            counters.change_followers(instance.author_id, 1)
+            timeline.follow(instance.user_id, instance.author)
+        return instance
+
 
 class RecipeShortInfoSerializer(serializers.ModelSerializer):
+    srcset = SrcsetField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'srcset', 'cooking_time')
 
 
 class FollowListSerializer(serializers.ModelSerializer):
     recipes = SerializerMethodField()
-    recipes_count = SerializerMethodField()
     is_subscribed = SerializerMethodField(read_only=True)
 
     class Meta:
@@ -331,31 +433,45 @@ class FollowListSerializer(serializers.ModelSerializer):
             'is_subscribed', 'recipes', 'recipes_count'
         )
 
-    def get_recipes_count(self, author):
-        return Recipe.objects.filter(author=author).count()
-
     def get_recipes(self, author):
-        queryset = self.context.get('request')
-        recipes_limit = queryset.query_params.get('recipes_limit')
-        if not recipes_limit:
-            return RecipeShortInfoSerializer(
-                Recipe.objects.filter(author=author),
-                many=True, context={'request': queryset}
-            ).data
+        request = self.context.get('request')
+        recipes = getattr(author, 'limited_recipes', None)
+        if recipes is None:
+            recipes = Recipe.objects.filter(author=author)
+            recipes_limit = request.query_params.get('recipes_limit')
+            if recipes_limit:
+                recipes = recipes[:int(recipes_limit)]
         return RecipeShortInfoSerializer(
-            Recipe.objects.filter(author=author)[:int(recipes_limit)],
-            many=True,
-            context={'request': queryset}
+            recipes, many=True, context={'request': request}
         ).data
 
     def get_is_subscribed(self, author):
-        return Follow.objects.filter(
-            user=self.context.get('request').user,
-            author=author
-        ).exists()
+        if hasattr(author, 'is_subscribed'):
+            return author.is_subscribed
+        flags = user_flags.get_for_request(self.context.get('request'))
+        return flags is not None and author.id in flags.follows
+
+
+class UserRecipeSerializer(ModelSerializer):
+    """Добавление рецепта в избранное или корзину пользователя."""
+    exists_error = None
+
+    def check_exists(self, user, recipe):
+        if self.Meta.model.objects.filter(user=user, recipe=recipe).exists():
+            raise ValidationError({'errors': self.exists_error})
+
+    def create(self, validated_data):
+        # Пакетное добавление держит ту же блокировку, иначе рецепт,
+        # добавленный одновременно обоими способами, посчитался бы дважды.
+        user = validated_data['user']
+        shopping_list_items.lock_users([user.id])
+        self.check_exists(user, validated_data['recipe'])
+        return super().create(validated_data)
 
 
-class FavoriteSerializer(ModelSerializer):
+class FavoriteSerializer(UserRecipeSerializer):
+    exists_error = 'Уже есть в избранном.'
+
     class Meta:
         model = Favorite
         fields = ('user', 'recipe')
@@ -364,13 +480,16 @@ class FavoriteSerializer(ModelSerializer):
         request = self.context.get('request')
         if not request or request.user.is_anonymous:
             return False
-        recipe = data['recipe']
-        if Favorite.objects.filter(user=request.user, recipe=recipe).exists():
-            raise ValidationError({
-                'errors': 'Уже есть в избранном.'
-            })
+        self.check_exists(request.user, data['recipe'])
         return data
 
+    def create(self, validated_data):
+        with transaction.atomic():
+            instance = super().create(validated_data)
+            counters.change_recipes(
+                (instance.recipe_id,), counters.FAVORITES, 1)
+        return instance
+
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
@@ -378,23 +497,52 @@ class FavoriteSerializer(ModelSerializer):
             instance.recipe, context=context).data
 
 
-class CartSerializer(ModelSerializer):
+class CartSerializer(UserRecipeSerializer):
+    exists_error = 'Данный рецепт уже есть в корзине.'
+
     class Meta:
         fields = ['recipe', 'user']
         model = Cart
 
     def validate(self, data):
         request = self.context.get('request')
-        recipe = data['recipe']
-        if Cart.objects.filter(
-            user=request.user, recipe=recipe
-        ).exists():
-            raise ValidationError({
-                'errors': 'Данный рецепт уже есть в корзине.'
-            })
+        self.check_exists(request.user, data['recipe'])
         return data
 
+    def create(self, validated_data):
+        with transaction.atomic():
+            instance = super().create(validated_data)
+            counters.change_recipes(
+                (instance.recipe_id,), counters.CARTS, 1)
+            shopping_list_items.change_cart(
+                instance.user_id, (instance.recipe_id,), 1)
+        return instance
+
     def to_representation(self, instance):
         request = self.context.get('request')
         context = {'request': request}
         return RecipeShortInfoSerializer(instance.recipe, context=context).data
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_RECIPES_LIMIT,
+        error_messages={
+            'max_length': 'Не больше {max_length} рецептов за запрос.'},
+    )
+
+
+class ShoppingListJobSerializer(ModelSerializer):
+    download = SerializerMethodField()
+
+    class Meta:
+        model = ShoppingListJob
+        fields = ('id', 'status', 'created', 'finished', 'error', 'download')
+
+    def get_download(self, job):
+        if job.status != DONE:
+            return None
+        return self.context['request'].build_absolute_uri(reverse(
+            'api:recipes-shopping-list-job-file', args=[job.pk]))
@@ -0,0 +1,108 @@
+import csv
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from food.models import ShoppingListItem
+
+PDF_TEMPLATE = 'recipes/pdf_template.html'
+PDF_CACHE_TIMEOUT = 60 * 60 * 24
+PDF_CACHE_KEY = 'shopping_list_pdf:{}'
+USER_DIGEST_CACHE_KEY = 'shopping_list_digest:{}'
+
+
+def get_shopping_list_queryset(user):
+    """Сводный список ингредиентов из корзины пользователя в виде
+    кортежей (название, количество, единица измерения)."""
+    return ShoppingListItem.objects.filter(user=user).order_by(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).values_list(
+        'ingredient__name', 'amount', 'ingredient__measurement_unit'
+    )
+
+
+def get_shopping_list(user):
+    return list(get_shopping_list_queryset(user))
+
+
+def get_digest(shopping_list):
+    """Адрес содержимого списка покупок: одинаковые списки дают
+    одинаковый дайджест, любое изменение корзины — новый."""
+    payload = json.dumps([PDF_TEMPLATE, shopping_list], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def render_pdf(shopping_list):
+    # WeasyPrint загружает Pango и шрифты, это долго и занимает память,
+    # поэтому импортируется только процессом, которому нужен PDF.
+    from weasyprint import HTML
+
+    html_template = render_to_string(PDF_TEMPLATE,
+                                     {'ingredients': shopping_list})
+    return HTML(string=html_template).write_pdf()
+
+
+def get_pdf(user, shopping_list, digest):
+    """Возвращает PDF из кэша, отрисовывая его только при промахе."""
+    key = PDF_CACHE_KEY.format(digest)
+    pdf = cache.get(key)
+    if pdf is None:
+        pdf = render_pdf(shopping_list)
+        cache.set(key, pdf, PDF_CACHE_TIMEOUT)
+    cache.set(USER_DIGEST_CACHE_KEY.format(user.id), digest,
+              PDF_CACHE_TIMEOUT)
+    return pdf
+
+
+def invalidate(user_ids):
+    """Удаляет из кэша PDF, последними выданные пользователям."""
+    user_keys = [USER_DIGEST_CACHE_KEY.format(user_id)
+                 for user_id in set(user_ids)]
+    if not user_keys:
+        return
+    digests = cache.get_many(user_keys).values()
+    cache.delete_many(
+        user_keys + [PDF_CACHE_KEY.format(digest) for digest in digests]
+    )
+
+
+class Echo:
+    """Буфер для csv.writer, возвращающий строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+def stream_txt(items):
+    yield 'Список покупок\n\n'
+    for name, amount, measurement_unit in items:
+        yield f'{name} - {amount} {measurement_unit}\n'
+
+
+def stream_csv(items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'amount', 'measurement_unit'))
+    for item in items:
+        yield writer.writerow(item)
+
+
+def stream_json(items):
+    separator = ''
+    yield '['
+    for name, amount, measurement_unit in items:
+        yield separator + json.dumps({
+            'name': name,
+            'amount': amount,
+            'measurement_unit': measurement_unit,
+        }, ensure_ascii=False)
+        separator = ', '
+    yield ']'
+
+
+STREAM_FORMATS = {
+    'txt': (stream_txt, 'text/plain; charset=utf-8'),
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+    'json': (stream_json, 'application/json'),
+}
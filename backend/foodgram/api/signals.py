@@ -0,0 +1,137 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from . import response_cache, shopping_list, snapshots
+from .autocomplete import ingredient_index
+from .user_flags import SOURCES, user_flags
+from food import shopping_list_items
+from food.models import (Cart, Favorite, Ingredient, IngredientRecipe, Recipe,
+                         Tag)
+from users.models import Follow, User
+
+# Поля рецепта, которые входят в снимок представления.
+SNAPSHOT_RECIPE_FIELDS = {'name', 'text', 'pub_date', 'cooking_time',
+                          'author'}
+
+
+@receiver((post_save, post_delete), sender=Cart)
+def invalidate_cart_shopping_list(sender, instance, **kwargs):
+    shopping_list.invalidate([instance.user_id])
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def invalidate_recipe_shopping_lists(sender, instance, **kwargs):
+    shopping_list.invalidate(Cart.objects.filter(
+        recipe_id=instance.recipe_id
+    ).values_list('user_id', flat=True))
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    ingredient_index.invalidate()
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_shopping_lists(sender, instance, **kwargs):
+    amounts = dict(instance.ingridients_recipe.values_list(
+        'ingredient_id', 'amount'))
+    # Строки корзины удалятся каскадно, без обновления списков покупок.
+    shopping_list_items.change_recipe(instance.id, amounts, {})
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+@receiver(post_delete, sender=User)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_responses(sender, **kwargs):
+    response_cache.bump(response_cache.RECIPES)
+
+
+@receiver(pre_save, sender=User)
+def check_author_changed(sender, instance, update_fields, **kwargs):
+    """Отмечает, изменились ли поля автора из снимков рецептов: вход,
+    смена пароля и активация сохраняют пользователя целиком, но эти поля
+    не меняют."""
+    instance.author_changed = False
+    if not instance.pk or (update_fields and not set(update_fields) & set(
+            snapshots.AUTHOR_FIELDS)):
+        return
+    old = User.objects.filter(pk=instance.pk, recipes_count__gt=0).values_list(
+        *snapshots.AUTHOR_FIELDS).first()
+    instance.author_changed = old is not None and old != tuple(
+        getattr(instance, field) for field in snapshots.AUTHOR_FIELDS)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_responses(sender, instance, **kwargs):
+    if instance.author_changed:
+        response_cache.bump(response_cache.RECIPES)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tag_responses(sender, **kwargs):
+    response_cache.bump(response_cache.TAGS, response_cache.RECIPES)
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_responses(sender, **kwargs):
+    response_cache.bump(response_cache.INGREDIENTS, response_cache.RECIPES)
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=Cart)
+@receiver((post_save, post_delete), sender=Follow)
+def invalidate_user_responses(sender, instance, **kwargs):
+    response_cache.bump(user_ids=[instance.user_id])
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_recipe_snapshot(sender, instance, update_fields, **kwargs):
+    if update_fields and not set(update_fields) & SNAPSHOT_RECIPE_FIELDS:
+        return
+    snapshots.invalidate(Recipe.objects.filter(pk=instance.pk))
+
+
+@receiver((post_save, post_delete), sender=IngredientRecipe)
+def invalidate_ingredients_snapshot(sender, instance, **kwargs):
+    snapshots.invalidate(Recipe.objects.filter(pk=instance.recipe_id))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_tags_snapshots(sender, instance, action, reverse, pk_set,
+                              **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        recipes = Recipe.objects.filter(pk=instance.pk)
+    elif pk_set:
+        recipes = Recipe.objects.filter(pk__in=pk_set)
+    else:
+        recipes = Recipe.objects.filter(tags=instance)
+    snapshots.invalidate(recipes)
+
+
+@receiver((post_save, pre_delete), sender=Tag)
+def invalidate_tag_snapshots(sender, instance, **kwargs):
+    snapshots.invalidate(Recipe.objects.filter(tags=instance))
+
+
+@receiver((post_save, pre_delete), sender=Ingredient)
+def invalidate_ingredient_snapshots(sender, instance, **kwargs):
+    snapshots.invalidate(Recipe.objects.filter(ingredients=instance))
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_snapshots(sender, instance, **kwargs):
+    if instance.author_changed:
+        snapshots.invalidate(Recipe.objects.filter(author=instance))
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=Cart)
+@receiver((post_save, post_delete), sender=Follow)
+def change_user_flags(sender, instance, signal, **kwargs):
+    _, field = SOURCES[sender]
+    user_flags.change(sender, instance.user_id, [getattr(instance, field)],
+                      added=signal is post_save)
@@ -0,0 +1,196 @@
+"""Готовые представления рецептов для чтения.
+
+В Recipe.snapshot хранится часть представления RecipeSerializer, которая
+не зависит от пользователя и запроса: автор, теги, ингредиенты, текст.
+Признаки пользователя, счётчики и адреса картинок дописываются при
+чтении, поэтому лента и страница рецепта не сериализуют вложенные
+объекты.
+
+Изменение рецепта, его тегов, ингредиентов или автора увеличивает
+Recipe.snapshot_generation (см. signals), а после фиксации транзакции
+снимки этих рецептов пересобираются и сохраняются. Снимок, собранный
+для другого поколения или другой версии SNAPSHOT_VERSION, считается
+устаревшим: чтение собирает его заново в памяти, но не записывает,
+сохранить устаревшие снимки можно командой rebuild_recipe_snapshots.
+Поколение записано в самом снимке, поэтому снимок, собранный
+одновременно с изменением рецепта, не выдаётся за свежий.
+
+Если изменение затрагивает больше INLINE_REBUILD_LIMIT рецептов
+(переименован тег, ингредиент), снимки не пересобираются в запросе:
+рецепты помечаются snapshot_pending, и их собирает сервис
+snapshot_worker (rebuild_recipe_snapshots --pending --forever).
+"""
+from django.db import transaction
+from django.db.models import F, Prefetch, prefetch_related_objects
+from rest_framework import serializers
+
+from . import user_flags
+from .serializers import RecipeSerializer
+from food.models import IngredientRecipe, Recipe
+from users.models import User
+
+# Увеличивается при изменении формата снимка.
+SNAPSHOT_VERSION = 1
+
+AUTHOR_FIELDS = ('email', 'id', 'username', 'first_name', 'last_name')
+RECIPE_FIELDS = ('id', 'author', 'name', 'text', 'ingredients', 'pub_date',
+                 'tags', 'cooking_time')
+REBUILD_BATCH_SIZE = 500
+INLINE_REBUILD_LIMIT = 100
+
+
+class SnapshotAuthorSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = User
+        fields = AUTHOR_FIELDS
+
+
+class SnapshotSourceSerializer(RecipeSerializer):
+    """Часть RecipeSerializer, которая хранится в снимке."""
+    author = SnapshotAuthorSerializer(read_only=True)
+
+    class Meta(RecipeSerializer.Meta):
+        fields = RECIPE_FIELDS
+
+
+def is_fresh(recipe):
+    return (recipe.snapshot.get('version') == SNAPSHOT_VERSION
+            and recipe.snapshot.get('generation')
+            == recipe.snapshot_generation)
+
+
+def build(recipes):
+    """Собирает устаревшие снимки рецептов в памяти фиксированным числом
+    запросов и возвращает эти рецепты. В базу ничего не пишется."""
+    stale = [recipe for recipe in recipes if not is_fresh(recipe)]
+    if not stale:
+        return stale
+    prefetch_related_objects(
+        stale, 'author', 'tags',
+        Prefetch('ingridients_recipe',
+                 queryset=IngredientRecipe.objects.select_related(
+                     'ingredient')),
+    )
+    for recipe, data in zip(
+            stale, SnapshotSourceSerializer(stale, many=True).data):
+        recipe.snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'generation': recipe.snapshot_generation,
+            'data': data,
+        }
+    return stale
+
+
+def refresh(recipes):
+    """Пересобирает и сохраняет устаревшие снимки рецептов."""
+    stale = build(recipes)
+    if stale:
+        Recipe.objects.bulk_update(stale, ('snapshot',))
+
+
+def rebuild(recipes):
+    """Пересобирает снимки рецептов из queryset, даже свежие."""
+    recipes = list(recipes)
+    for recipe in recipes:
+        recipe.snapshot = {}
+    refresh(recipes)
+    return len(recipes)
+
+
+def refresh_ids(recipe_ids):
+    """Пересобирает устаревшие снимки рецептов с recipe_ids пачками."""
+    recipe_ids = list(recipe_ids)
+    for start in range(0, len(recipe_ids), REBUILD_BATCH_SIZE):
+        refresh(Recipe.objects.filter(
+            pk__in=recipe_ids[start:start + REBUILD_BATCH_SIZE]))
+
+
+def invalidate(recipes):
+    """Помечает снимки рецептов из queryset устаревшими. Не больше
+    INLINE_REBUILD_LIMIT рецептов пересобираются после фиксации
+    транзакции, остальные отдаются snapshot_worker. Если в одной
+    транзакции рецепт меняется несколько раз, пересобирается только
+    первый раз, остальные вызовы застают свежий снимок."""
+    recipe_ids = list(
+        recipes.values_list('pk', flat=True)[:INLINE_REBUILD_LIMIT + 1])
+    if not recipe_ids:
+        return 0
+    if len(recipe_ids) > INLINE_REBUILD_LIMIT:
+        return Recipe.objects.filter(pk__in=recipes.values('pk')).update(
+            snapshot_generation=F('snapshot_generation') + 1,
+            snapshot_pending=True)
+    count = Recipe.objects.filter(pk__in=recipe_ids).update(
+        snapshot_generation=F('snapshot_generation') + 1)
+    transaction.on_commit(lambda: refresh_ids(recipe_ids))
+    return count
+
+
+def refresh_pending(batch_size=REBUILD_BATCH_SIZE):
+    """Пересобирает пачку снимков, помеченных snapshot_pending, и
+    возвращает её размер. Пометка снимается до сборки: рецепт, изменённый
+    во время сборки, будет помечен снова."""
+    recipe_ids = list(Recipe.objects.filter(
+        snapshot_pending=True).values_list('pk', flat=True)[:batch_size])
+    if recipe_ids:
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            snapshot_pending=False)
+        refresh(Recipe.objects.filter(pk__in=recipe_ids))
+    return len(recipe_ids)
+
+
+class RecipeSnapshotListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        recipes = list(data)
+        build(recipes)
+        user_flags.get_for_request(self.context.get('request'), recipes)
+        return super().to_representation(recipes)
+
+
+class RecipeSnapshotSerializer(serializers.Serializer):
+    """Рецепт в формате RecipeSerializer, собранный из снимка.
+
+    Признаки пользователя берутся из user_flags.
+    """
+    image = serializers.ImageField(read_only=True)
+    srcset = serializers.SerializerMethodField()
+
+    class Meta:
+        list_serializer_class = RecipeSnapshotListSerializer
+
+    def get_srcset(self, recipe):
+        return RecipeSerializer(
+            context=self.context).fields['srcset'].to_representation(
+            recipe.image_variants)
+
+    def to_representation(self, recipe):
+        if not is_fresh(recipe):
+            build([recipe])
+        flags = user_flags.get_for_request(self.context.get('request'))
+        data = recipe.snapshot['data']
+        representation = dict(
+            data,
+            author=dict(
+                data['author'],
+                is_subscribed=(flags is not None
+                               and recipe.author_id in flags.follows)),
+            image=self.fields['image'].to_representation(recipe.image),
+            srcset=self.get_srcset(recipe),
+            is_in_shopping_cart=(flags is not None
+                                 and recipe.id in flags.cart),
+            is_favorited=flags is not None and recipe.id in flags.favorites,
+            favorites_count=recipe.favorites_count,
+            in_carts_count=recipe.in_carts_count,
+        )
+        return {name: representation[name]
+                for name in RecipeSerializer.Meta.fields}
+
+
+class PantryRecipeSerializer(RecipeSnapshotSerializer):
+
+    def to_representation(self, recipe):
+        representation = super().to_representation(recipe)
+        representation['found_ingredients'] = recipe.found_ingredients
+        representation['missing_ingredients'] = recipe.missing_ingredients
+        return representation
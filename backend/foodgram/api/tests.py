@@ -0,0 +1,903 @@
+import base64
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import update_last_login
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from PIL import Image
+from django.test.utils import CaptureQueriesContext
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient, APIRequestFactory
+
+from . import benchmark, response_cache, snapshots
+from .autocomplete import ingredient_index
+from .serializers import CartSerializer
+from food import counters, shopping_list_items, timeline
+from .user_flags import user_flags
+from food.models import (Cart, Favorite, Ingredient, IngredientRecipe, Recipe,
+                         RecipeImageJob, ShoppingListItem, Tag,
+                         TimelineEntry)
+from food.models.shopping_list import DONE, PENDING
+from users.models import Follow, User
+
+RECIPES_URL = '/api/recipes/'
+SUBSCRIPTIONS_URL = '/api/users/subscriptions/'
+FEED_URL = '/api/recipes/feed/'
+FILE_CACHE_BACKEND = 'django.core.cache.backends.filebased.FileBasedCache'
+
+
+class RecipeListQueriesTest(TestCase):
+    """Число запросов к базе на страницу рецептов не зависит от её
+    размера."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='reader',
+                                       email='reader@foodgram.ru')
+        authors = [
+            User.objects.create(username=f'author{i}',
+                                email=f'author{i}@foodgram.ru')
+            for i in range(5)
+        ]
+        tags = [
+            Tag.objects.create(name=f'Тег {i}', color=f'#00000{i}',
+                               slug=f'tag{i}')
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(10)
+        ]
+        for i in range(30):
+            recipe = Recipe.objects.create(
+                author=authors[i % len(authors)], name=f'Рецепт {i}',
+                text='Описание', cooking_time=10)
+            recipe.tags.set(tags[:2])
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(recipe=recipe,
+                                 ingredient=ingredients[(i + j) % 10],
+                                 amount=j + 1)
+                for j in range(3))
+            if i % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if i % 3 == 0:
+                Cart.objects.create(user=cls.user, recipe=recipe)
+        Follow.objects.create(user=cls.user, author=authors[0])
+
+    def setUp(self):
+        cache.clear()
+        user_flags._entries.clear()
+        self.client = APIClient()
+
+    def assert_constant_queries(self):
+        # Первый запрос прогревает кэши процесса.
+        self.client.get(RECIPES_URL, {'limit': 1})
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(RECIPES_URL, {'limit': 2})
+        self.assertEqual(len(response.data['results']), 2)
+        for limit in (6, 20):
+            with self.assertNumQueries(len(context.captured_queries)):
+                response = self.client.get(RECIPES_URL, {'limit': limit})
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_list_anonymous(self):
+        self.assert_constant_queries()
+
+    def test_list_authenticated(self):
+        self.client.force_authenticate(self.user)
+        self.assert_constant_queries()
+
+
+class SubscriptionsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='reader',
+                                       email='reader@foodgram.ru')
+        cls.authors = [
+            User.objects.create(username=f'author{i}',
+                                email=f'author{i}@foodgram.ru',
+                                recipes_count=5)
+            for i in range(12)
+        ]
+        Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'Рецепт {i}', text='Описание',
+                   cooking_time=10)
+            for author in cls.authors for i in range(5))
+
+    def setUp(self):
+        cache.clear()
+        user_flags._entries.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_without_subscriptions(self):
+        response = self.client.get(
+            SUBSCRIPTIONS_URL, {'page': 1, 'limit': 6, 'recipes_limit': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 0)
+        self.assertEqual(response.data['results'], [])
+
+    def test_recipes_limit(self):
+        Follow.objects.bulk_create(
+            Follow(user=self.user, author=author)
+            for author in self.authors)
+        response = self.client.get(
+            SUBSCRIPTIONS_URL, {'limit': 6, 'recipes_limit': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 6)
+        for author in response.data['results']:
+            self.assertEqual(len(author['recipes']), 3)
+            self.assertEqual(author['recipes_count'], 5)
+
+    def test_constant_queries(self):
+        Follow.objects.bulk_create(
+            Follow(user=self.user, author=author)
+            for author in self.authors)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(SUBSCRIPTIONS_URL, {'limit': 2,
+                                                'recipes_limit': 3})
+        with self.assertNumQueries(len(context.captured_queries)):
+            response = self.client.get(
+                SUBSCRIPTIONS_URL, {'limit': 12, 'recipes_limit': 3})
+        self.assertEqual(len(response.data['results']), 12)
+
+
+class ResponseCacheTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='reader',
+                                       email='reader@foodgram.ru',
+                                       recipes_count=1)
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name='Рецепт', text='Описание',
+            cooking_time=10)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def get_recipes_version(self):
+        return response_cache.get_versions(
+            [response_cache.SCOPE_VERSION_KEY.format(
+                response_cache.RECIPES)])[0]
+
+    def get_favorites_count(self, params=None):
+        response = self.client.get(RECIPES_URL, params)
+        return response.data['results'][0]['favorites_count']
+
+    def is_cached(self, params=None):
+        """Ответ взят из кэша: список рецептов не считался заново."""
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(RECIPES_URL, params)
+        return not [query for query in context.captured_queries
+                    if 'COUNT(' in query['sql']]
+
+    def test_login_keeps_recipe_responses(self):
+        version = self.get_recipes_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            update_last_login(None, self.user)
+        self.assertEqual(self.get_recipes_version(), version)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Автор'
+            self.user.save()
+        self.assertNotEqual(self.get_recipes_version(), version)
+
+    def test_per_process_cache_skips_user_responses(self):
+        self.client.get(RECIPES_URL)
+        self.assertTrue(self.is_cached())
+        self.client.force_authenticate(self.user)
+        self.client.get(RECIPES_URL)
+        self.assertFalse(self.is_cached())
+
+    def test_shared_cache_keeps_user_responses(self):
+        with tempfile.TemporaryDirectory() as location, override_settings(
+                CACHES={'default': {
+                    'BACKEND': FILE_CACHE_BACKEND, 'LOCATION': location}}):
+            self.client.force_authenticate(self.user)
+            self.client.get(RECIPES_URL)
+            self.assertTrue(self.is_cached())
+
+    def test_counters_read_with_cached_response(self):
+        self.assertEqual(self.get_favorites_count(), 0)
+        # Счётчики меняются update() без сигналов и без сброса кэша.
+        counters.change_recipes([self.recipe.id], counters.FAVORITES, 1)
+        self.assertTrue(self.is_cached())
+        self.assertEqual(self.get_favorites_count(), 1)
+        url = f'{RECIPES_URL}{self.recipe.id}/'
+        self.client.get(url)
+        counters.change_recipes([self.recipe.id], counters.FAVORITES, 1)
+        self.assertEqual(self.client.get(url).data['favorites_count'], 2)
+        self.get_favorites_count({'ordering': 'popular'})
+        self.assertFalse(self.is_cached({'ordering': 'popular'}))
+
+
+class UserFlagsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='reader',
+                                       email='reader@foodgram.ru')
+        cls.author = User.objects.create(username='author',
+                                         email='author@foodgram.ru')
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Описание',
+            cooking_time=10)
+
+    def setUp(self):
+        cache.clear()
+        user_flags._entries.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_flags(self):
+        recipe = self.client.get(RECIPES_URL).data['results'][0]
+        return (recipe['is_favorited'], recipe['is_in_shopping_cart'],
+                recipe['author']['is_subscribed'])
+
+    def add_flags(self):
+        # Как запись из другого процесса: версия в этом процессе
+        # не меняется.
+        Favorite.objects.bulk_create(
+            [Favorite(user=self.user, recipe=self.recipe)])
+        Cart.objects.bulk_create([Cart(user=self.user, recipe=self.recipe)])
+        Follow.objects.bulk_create(
+            [Follow(user=self.user, author=self.author)])
+
+    def test_per_process_cache_reads_database(self):
+        self.assertEqual(self.get_flags(), (False, False, False))
+        self.add_flags()
+        self.assertEqual(self.get_flags(), (True, True, True))
+
+    def test_shared_cache_keeps_flags_in_memory(self):
+        with tempfile.TemporaryDirectory() as location, override_settings(
+                CACHES={'default': {
+                    'BACKEND': FILE_CACHE_BACKEND, 'LOCATION': location}},
+                RESPONSE_CACHE_TIMEOUT=0):
+            self.assertEqual(self.get_flags(), (False, False, False))
+            self.add_flags()
+            self.assertEqual(self.get_flags(), (False, False, False))
+            with self.captureOnCommitCallbacks(execute=True):
+                user_flags.invalidate([self.user.id])
+            self.assertEqual(self.get_flags(), (True, True, True))
+
+
+class SnapshotTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author',
+                                         email='author@foodgram.ru')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def create_recipe(self):
+        return Recipe.objects.create(author=self.author, name='Рецепт',
+                                     text='Описание', cooking_time=10)
+
+    def test_read_does_not_write(self):
+        recipe = self.create_recipe()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(RECIPES_URL)
+            self.client.get(f'{RECIPES_URL}{recipe.id}/')
+        self.assertEqual(response.data['results'][0]['name'], 'Рецепт')
+        self.assertFalse([
+            query for query in context.captured_queries
+            if not query['sql'].startswith('SELECT')])
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.snapshot, {})
+
+    def test_rebuilt_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = self.create_recipe()
+        recipe.refresh_from_db()
+        self.assertTrue(snapshots.is_fresh(recipe))
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.name = 'Новое название'
+            recipe.save()
+        recipe.refresh_from_db()
+        self.assertTrue(snapshots.is_fresh(recipe))
+        self.assertEqual(recipe.snapshot['data']['name'], 'Новое название')
+
+    def test_author_save_without_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = self.create_recipe()
+        User.objects.filter(pk=self.author.pk).update(recipes_count=1)
+        author = User.objects.get(pk=self.author.pk)
+        author.set_password('new-password')
+        author.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.snapshot_generation, 1)
+        author.first_name = 'Новое имя'
+        with self.captureOnCommitCallbacks(execute=True):
+            author.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.snapshot['data']['author']['first_name'],
+                         'Новое имя')
+
+    def test_large_change_left_to_worker(self):
+        tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        with self.captureOnCommitCallbacks(execute=True):
+            recipes = [self.create_recipe() for _ in range(3)]
+            for recipe in recipes:
+                recipe.tags.set([tag])
+        tag.name = 'Новый тег'
+        with mock.patch.object(snapshots, 'INLINE_REBUILD_LIMIT', 2):
+            with self.captureOnCommitCallbacks(execute=True):
+                tag.save()
+        self.assertFalse([recipe for recipe in Recipe.objects.all()
+                          if snapshots.is_fresh(recipe)])
+        self.assertEqual(Recipe.objects.filter(
+            snapshot_pending=True).count(), 3)
+        call_command('rebuild_recipe_snapshots', '--pending',
+                     stdout=StringIO())
+        for recipe in Recipe.objects.all():
+            self.assertTrue(snapshots.is_fresh(recipe))
+            self.assertFalse(recipe.snapshot_pending)
+            self.assertEqual(recipe.snapshot['data']['tags'][0]['name'],
+                             'Новый тег')
+
+
+class PantryTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='author',
+                                       email='author@foodgram.ru')
+        cls.tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(4)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, ingredients):
+        response = self.client.post(RECIPES_URL, {
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'tags': [self.tag.id],
+            'ingredients': [{'id': ingredient.id, 'amount': 1}
+                            for ingredient in ingredients],
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def find(self, ingredients):
+        response = self.client.get(RECIPES_URL + 'pantry/', {
+            'ingredients': ','.join(str(ingredient.id)
+                                    for ingredient in ingredients)})
+        return [(recipe['id'], recipe['found_ingredients'],
+                 recipe['missing_ingredients'])
+                for recipe in response.data['results']]
+
+    def test_ranking(self):
+        first, second, third, fourth = self.ingredients
+        half = self.create_recipe([first, second, third, fourth])
+        full = self.create_recipe([first, second])
+        most = self.create_recipe([first, second, third])
+        other = self.create_recipe([first, third])
+        self.assertEqual(Recipe.objects.get(pk=half).ingredients_count, 4)
+        # При равной доле выше рецепт, где недостаёт меньше.
+        self.assertEqual(self.find([first, second]), [
+            (full, 2, 0), (most, 2, 1), (other, 1, 1), (half, 2, 2)])
+
+    @override_settings(PANTRY_CANDIDATES_PER_INGREDIENT=2)
+    def test_candidates_per_ingredient(self):
+        first, second = self.ingredients[:2]
+        oldest = self.create_recipe([first, second])
+        newer = [self.create_recipe([first, second]) for _ in range(2)]
+        found = [recipe_id for recipe_id, _, _ in self.find([first])]
+        self.assertEqual(found, newer[::-1])
+        self.assertNotIn(oldest, found)
+
+    def test_update_changes_count(self):
+        first, second, third = self.ingredients[:3]
+        recipe_id = self.create_recipe([first, third])
+        response = self.client.patch(f'{RECIPES_URL}{recipe_id}/', {
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'tags': [self.tag.id],
+            'ingredients': [{'id': ingredient.id, 'amount': 1}
+                            for ingredient in (first, second, third)],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            Recipe.objects.get(pk=recipe_id).ingredients_count, 3)
+        self.assertEqual(self.find([first]), [(recipe_id, 1, 2)])
+
+
+class ImageJobTest(TransactionTestCase):
+    """Обработчик очереди закрывает соединения с базой, поэтому тест
+    идёт без общей транзакции."""
+
+    def setUp(self):
+        self.author = User.objects.create(username='author',
+                                          email='author@foodgram.ru')
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    @staticmethod
+    def get_image():
+        buffer = BytesIO()
+        Image.new('RGB', (800, 600), 'orange').save(buffer, 'PNG')
+        return 'data:image/png;base64,' + base64.b64encode(
+            buffer.getvalue()).decode()
+
+    def create_recipe(self):
+        tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(2)
+        ]
+        response = self.client.post(RECIPES_URL, {
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'tags': [tag.id],
+            'ingredients': [{'id': ingredient.id, 'amount': 1}
+                            for ingredient in ingredients],
+            'image': self.get_image(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return Recipe.objects.get(pk=response.data['id'])
+
+    def test_worker_builds_variants(self):
+        with tempfile.TemporaryDirectory() as media, override_settings(
+                MEDIA_ROOT=media):
+            recipe = self.create_recipe()
+            job = RecipeImageJob.objects.get(recipe=recipe)
+            self.assertEqual(job.status, PENDING)
+            call_command('render_image_variants', once=True, workers=1)
+            recipe.refresh_from_db()
+            job.refresh_from_db()
+        self.assertEqual(job.status, DONE)
+        self.assertEqual(
+            [width for width, _ in recipe.image_variants['webp']],
+            [320, 640, 800])
+
+
+class StartupTest(SimpleTestCase):
+
+    def test_weasyprint_is_lazy(self):
+        """WeasyPrint загружается только при первой отрисовке PDF, а не
+        при старте процесса."""
+        startup = benchmark.measure_startup(runs=1)
+        self.assertEqual(startup['eager_modules'], [])
+
+
+class CursorPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(username='author',
+                                     email='author@foodgram.ru')
+        for i in range(10):
+            Recipe.objects.create(author=author, name=f'Рецепт {i}',
+                                  text='Описание', cooking_time=10)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_same_order_as_pages(self):
+        pages = []
+        for page in (1, 2, 3):
+            response = self.client.get(RECIPES_URL, {'page': page,
+                                                     'limit': 4})
+            pages += [recipe['id'] for recipe in response.data['results']]
+        cursor_pages = []
+        url = RECIPES_URL + '?pagination=cursor&limit=4'
+        while url:
+            response = self.client.get(url)
+            cursor_pages += [
+                recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(cursor_pages, pages)
+
+    def test_rejected_orders(self):
+        for params in ({'search': 'Рецепт'}, {'ordering': 'popular'}):
+            response = self.client.get(
+                RECIPES_URL, dict(params, pagination='cursor'))
+            self.assertEqual(response.status_code, 400, params)
+        response = self.client.get(
+            RECIPES_URL, {'ordering': 'pub_date', 'pagination': 'cursor'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_pantry_rejects_cursor(self):
+        response = self.client.get(
+            RECIPES_URL + 'pantry/',
+            {'ingredients': '1,2', 'pagination': 'cursor'})
+        self.assertEqual(response.status_code, 400)
+
+
+class FeedTest(TestCase):
+    """Лента листается по записям TimelineEntry, лишние записи удаляет
+    rebuild_timelines --trim."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='reader',
+                                       email='reader@foodgram.ru')
+        cls.author = User.objects.create(username='author',
+                                         email='author@foodgram.ru')
+        other = User.objects.create(username='other',
+                                    email='other@foodgram.ru')
+        Follow.objects.create(user=cls.user, author=cls.author)
+        for author in (cls.author, other):
+            for i in range(5):
+                Recipe.objects.create(author=author, name=f'Рецепт {i}',
+                                      text='Описание', cooking_time=10)
+        timeline.rebuild()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_ids(self, params):
+        ids = []
+        url = FEED_URL + '?' + urlencode(dict(params, limit=2))
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def test_pages_timeline_entries(self):
+        expected = list(Recipe.objects.filter(author=self.author).order_by(
+            '-pub_date', '-id').values_list('pk', flat=True))
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.get_ids({}), expected)
+        # Страница выбирается из записей ленты без соединения с рецептами.
+        self.assertFalse(any(
+            'food_timelineentry' in query['sql']
+            and 'food_recipe' in query['sql']
+            for query in queries.captured_queries))
+        self.assertEqual(self.get_ids({'pagination': 'cursor'}), expected)
+        self.assertEqual(
+            self.get_ids({'pagination': 'cursor',
+                          'author': self.author.id}), expected)
+        self.assertEqual(self.get_ids({'author': self.author.id}), expected)
+        # Рецепты авторов с большим числом подписчиков читаются при запросе.
+        with override_settings(TIMELINE_FANOUT_LIMIT=1):
+            self.assertEqual(self.get_ids({}), expected)
+            self.assertEqual(
+                self.get_ids({'pagination': 'cursor'}), expected)
+
+    @override_settings(TIMELINE_SIZE=3)
+    def test_trim_after_push(self):
+        recipe = Recipe.objects.create(author=self.author, name='Новый',
+                                       text='Описание', cooking_time=10)
+        with CaptureQueriesContext(connection) as context:
+            timeline.push(recipe)
+        # Публикация не считает записи лент подписчиков.
+        self.assertFalse([query for query in context.captured_queries
+                          if 'ROW_NUMBER' in query['sql']])
+        call_command('rebuild_timelines', '--trim', stdout=StringIO())
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(user=self.user).order_by(
+                *timeline.FEED_ORDERING).values_list('recipe', flat=True)),
+            list(Recipe.objects.filter(author=self.author).order_by(
+                '-pub_date', '-id').values_list('pk', flat=True)[:3]))
+
+
+class CartTest(TestCase):
+    """Рецепт, добавленный в корзину одновременно поштучно и пачкой,
+    учитывается один раз."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username='reader',
+                                       email='reader@foodgram.ru')
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name='Рецепт', text='Описание',
+            cooking_time=10)
+        cls.ingredient = Ingredient.objects.create(
+            name='Ингредиент', measurement_unit='г')
+        IngredientRecipe.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=100)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_single_add_after_bulk_add(self):
+        request = APIRequestFactory().post('/')
+        request.user = self.user
+        serializer = CartSerializer(
+            data={'user': self.user.id, 'recipe': self.recipe.id},
+            context={'request': request})
+        self.assertTrue(serializer.is_valid())
+        # Пачка добавлена между проверкой и сохранением поштучного запроса.
+        response = self.client.post(RECIPES_URL + 'shopping_cart/bulk/',
+                                    {'recipes': [self.recipe.id]},
+                                    format='json')
+        self.assertEqual(response.data['results'][0]['status'], 'added')
+        with self.assertRaises(ValidationError):
+            serializer.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.in_carts_count, 1)
+        self.assertEqual(ShoppingListItem.objects.get(
+            user=self.user, ingredient=self.ingredient).amount, 100)
+
+
+class ShoppingListTest(TestCase):
+    """Список покупок совпадает с суммой по корзине после любых
+    изменений корзины и рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author',
+                                         email='author@foodgram.ru')
+        cls.user = User.objects.create(username='reader',
+                                       email='reader@foodgram.ru')
+        cls.tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(4)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.author_client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.author_client.force_authenticate(self.author)
+
+    def get_payload(self, amounts):
+        return {
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'tags': [self.tag.id],
+            'ingredients': [
+                {'id': self.ingredients[index].id, 'amount': amount}
+                for index, amount in amounts.items()],
+        }
+
+    def create_recipe(self, amounts):
+        response = self.author_client.post(
+            RECIPES_URL, self.get_payload(amounts), format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        return response.data['id']
+
+    def get_items(self):
+        items = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'amount')
+        }
+        self.assertEqual(items, shopping_list_items.get_live_totals())
+        return {ingredient_id: amount
+                for (_, ingredient_id), amount in items.items()}
+
+    def test_items_follow_cart_and_recipes(self):
+        first, second, third, fourth = (
+            ingredient.id for ingredient in self.ingredients)
+        edited = self.create_recipe({0: 1, 1: 2})
+        removed = self.create_recipe({1: 3, 2: 4})
+        for recipe_id in (edited, removed):
+            self.client.post(f'{RECIPES_URL}{recipe_id}/shopping_cart/')
+        self.assertEqual(self.get_items(), {first: 1, second: 5, third: 4})
+        response = self.author_client.patch(
+            f'{RECIPES_URL}{edited}/', self.get_payload({1: 5, 3: 1}),
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_items(), {second: 8, third: 4, fourth: 1})
+        self.client.delete(f'{RECIPES_URL}{removed}/shopping_cart/')
+        self.assertEqual(self.get_items(), {second: 5, fourth: 1})
+        self.author_client.delete(f'{RECIPES_URL}{edited}/')
+        self.assertEqual(self.get_items(), {})
+
+    def test_repeated_delete(self):
+        recipe_id = self.create_recipe({0: 1, 1: 2})
+        url = f'{RECIPES_URL}{recipe_id}/shopping_cart/'
+        self.client.post(url)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertEqual(Recipe.objects.get(pk=recipe_id).in_carts_count, 0)
+        self.assertEqual(self.get_items(), {})
+
+
+class RecipeUpdateTest(TestCase):
+    """Изменение рецепта меняет только изменившиеся строки состава."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author',
+                                         email='author@foodgram.ru')
+        cls.tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(12)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def send(self, method, url, amounts):
+        response = getattr(self.client, method)(url, {
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'tags': [self.tag.id],
+            'ingredients': [
+                {'id': self.ingredients[index].id, 'amount': amount}
+                for index, amount in amounts.items()],
+        }, format='json')
+        self.assertLess(response.status_code, 300, response.data)
+        return response
+
+    def get_rows(self, recipe_id):
+        return {
+            ingredient_id: (pk, amount)
+            for pk, ingredient_id, amount
+            in IngredientRecipe.objects.filter(recipe_id=recipe_id)
+            .values_list('pk', 'ingredient_id', 'amount')
+        }
+
+    def test_diff(self):
+        recipe_id = self.send(
+            'post', RECIPES_URL, {0: 1, 1: 2, 2: 3}).data['id']
+        url = f'{RECIPES_URL}{recipe_id}/'
+        before = self.get_rows(recipe_id)
+        self.send('patch', url, {0: 1, 1: 5, 3: 4})
+        after = self.get_rows(recipe_id)
+        first, second, third, fourth = (
+            ingredient.id for ingredient in self.ingredients[:4])
+        self.assertEqual(after[first], before[first])
+        self.assertEqual(after[second], (before[second][0], 5))
+        self.assertNotIn(third, after)
+        self.assertEqual(after[fourth][1], 4)
+
+    def test_removed_rows_without_per_row_queries(self):
+        counts = []
+        for removed in (1, 10):
+            recipe_id = self.send('post', RECIPES_URL, {
+                index: 1 for index in range(12)}).data['id']
+            with CaptureQueriesContext(connection) as context:
+                self.send('patch', f'{RECIPES_URL}{recipe_id}/', {
+                    index: 1 for index in range(removed, 12)})
+            counts.append(len(context))
+        self.assertEqual(counts[0], counts[1])
+
+
+class RecipeValidationTest(TestCase):
+    """id ингредиентов и тегов проверяются одним запросом на модель."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create(username='author',
+                                         email='author@foodgram.ru')
+        cls.tag = Tag.objects.create(name='Тег', color='#000000', slug='tag')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(20)
+        ]
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def post(self, ingredient_ids, tag_ids):
+        return self.client.post(RECIPES_URL, {
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 10,
+            'tags': tag_ids,
+            'ingredients': [{'id': pk, 'amount': 1}
+                            for pk in ingredient_ids],
+        }, format='json')
+
+    def test_all_missing_ids_in_one_error(self):
+        response = self.post(
+            [self.ingredients[0].id, 9998, 9999], [self.tag.id, 9997])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('9998, 9999', str(response.data['ingredients']))
+        self.assertIn('9997', str(response.data['tags']))
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_queries_do_not_depend_on_ingredients(self):
+        counts = []
+        for size in (2, 20):
+            with CaptureQueriesContext(connection) as context:
+                response = self.post(
+                    [ingredient.id for ingredient in self.ingredients[:size]],
+                    [self.tag.id])
+            self.assertEqual(response.status_code, 201, response.data)
+            counts.append(len(context))
+        self.assertEqual(counts[0], counts[1])
+
+
+class IngredientAutocompleteTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('Ершики', 'ёрш копчёный', 'Ёрш', 'Еда', 'Яблоко'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.invalidate()
+        self.client = APIClient()
+
+    def get_names(self, params):
+        response = self.client.get(
+            '/api/ingredients/autocomplete/', params)
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.data]
+
+    def test_prefix_without_case_and_yo(self):
+        expected = ['Ёрш', 'ёрш копчёный', 'Ершики']
+        self.assertEqual(self.get_names({'name': 'ЕРШ'}), expected)
+        self.assertEqual(self.get_names({'name': 'ёр'}), expected)
+        self.assertEqual(self.get_names({'name': 'я'}), ['Яблоко'])
+
+    def test_limit(self):
+        self.assertEqual(
+            self.get_names({'name': 'е', 'limit': 2}), ['Еда', 'Ёрш'])
+        with override_settings(INGREDIENT_AUTOCOMPLETE_LIMIT=1,
+                               INGREDIENT_AUTOCOMPLETE_MAX_LIMIT=3):
+            self.assertEqual(self.get_names({'name': 'е'}), ['Еда'])
+            self.assertEqual(
+                len(self.get_names({'name': 'е', 'limit': 10})), 3)
+
+
+class RecipeSearchTest(TestCase):
+    """На SQLite поиск работает через icontains с тем же порядком
+    релевантности."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create(username='author',
+                                     email='author@foodgram.ru')
+        ingredient = Ingredient.objects.create(name='борщевик',
+                                               measurement_unit='г')
+        for name, text in (('летний борщ', 'Описание'),
+                           ('борщ зелёный', 'Описание'),
+                           ('суп', 'Почти борщ'),
+                           ('борщ', 'Описание'),
+                           ('каша', 'Описание'),
+                           ('салат', 'Описание')):
+            recipe = Recipe.objects.create(
+                author=author, name=name, text=text, cooking_time=10)
+        IngredientRecipe.objects.create(
+            recipe=recipe, ingredient=ingredient, amount=1)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_fallback_ranking(self):
+        self.assertNotEqual(connection.vendor, 'postgresql')
+        response = self.client.get(RECIPES_URL, {'search': 'борщ'})
+        names = [recipe['name'] for recipe in response.data['results']]
+        # Затем совпадения в описании и ингредиентах, сначала новые.
+        self.assertEqual(names[:3], ['борщ', 'борщ зелёный', 'летний борщ'])
+        self.assertEqual(set(names[3:]), {'суп', 'салат'})
@@ -1,6 +1,7 @@
 from django.urls import include, path
 from rest_framework import routers
 
+from .metrics import metrics_view
 from .views import (CustomUserViewSet, IngredientViewSet, RecipeViewSet,
                     TagsViewSet)
 
@@ -13,6 +14,7 @@ router.register('tags', TagsViewSet)
 router.register('ingredients', IngredientViewSet)
 
 urlpatterns = [
+    path('metrics/', metrics_view, name='metrics'),
     path('', include(router.urls)),
     path('', include('djoser.urls')),
     path('auth/', include('djoser.urls.authtoken')),
@@ -0,0 +1,175 @@
+"""Признаки пользователя в памяти процесса.
+
+Для пользователя хранятся множества id рецептов в избранном и в корзине
+и id авторов, на которых он подписан, поэтому is_favorited,
+is_in_shopping_cart и is_subscribed проверяются без запросов к базе.
+Множества загружаются тремя запросами при первом обращении, процесс
+хранит их для USER_FLAGS_CACHE_SIZE последних пользователей.
+
+Каждое изменение избранного, корзины или подписок увеличивает версию
+пользователя в кэше Django. Процесс, который внёс изменение, обновляет
+множества на месте, остальные видят чужую версию и загружают их заново.
+Версию видят все процессы, только если кэш общий (redis, file). С locmem
+и DummyCache множества в памяти процесса не используются: признаки
+читаются из базы в каждом запросе, для страницы рецептов — только по её
+рецептам и авторам.
+"""
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from . import response_cache
+from food.models import Cart, Favorite
+from users.models import Follow
+
+VERSION_KEY = 'user_flags_version:{}'
+
+# Модель связи → (множество в UserFlags, поле с id).
+SOURCES = {
+    Favorite: ('favorites', 'recipe_id'),
+    Cart: ('cart', 'recipe_id'),
+    Follow: ('follows', 'author_id'),
+}
+
+
+def new_version():
+    return uuid.uuid4().int >> 64
+
+
+def get_version(user_id):
+    """Текущая версия признаков, None — если кэш не хранит версии."""
+    key = VERSION_KEY.format(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, new_version(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(user_id):
+    """Увеличивает версию и возвращает новую. None — версии не было,
+    и предыдущая неизвестна."""
+    key = VERSION_KEY.format(user_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, new_version(), None)
+        return None
+
+
+class UserFlags:
+    """Множества признаков пользователя. С recipes загружаются только
+    признаки этих рецептов и их авторов."""
+    __slots__ = ('version', 'loaded_at', 'favorites', 'cart', 'follows')
+
+    def __init__(self, user_id, version, recipes=None):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        scope = None
+        if recipes is not None:
+            scope = {
+                'recipe_id': {recipe.id for recipe in recipes},
+                'author_id': {recipe.author_id for recipe in recipes},
+            }
+        for model, (name, field) in SOURCES.items():
+            rows = model.objects.filter(user_id=user_id)
+            if scope is not None:
+                rows = rows.filter(**{f'{field}__in': scope[field]})
+            setattr(self, name, set(rows.values_list(field, flat=True)))
+
+
+class UserFlagsCache:
+    """LRU признаков пользователей в памяти процесса."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _is_fresh(entry, version):
+        return entry.version == version and (
+            time.monotonic() - entry.loaded_at < settings.USER_FLAGS_TTL)
+
+    def get(self, user_id):
+        version = get_version(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and self._is_fresh(entry, version):
+                self._entries.move_to_end(user_id)
+                return entry
+        # Запросы к базе идут без блокировки. Если признаки изменятся
+        # во время загрузки, у записи останется старая версия.
+        entry = UserFlags(user_id, version)
+        with self._lock:
+            self._entries[user_id] = entry
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > settings.USER_FLAGS_CACHE_SIZE:
+                self._entries.popitem(last=False)
+        return entry
+
+    def change(self, model, user_id, ids, added):
+        """После фиксации транзакции добавляет ids в множество модели
+        model или удаляет их оттуда."""
+        ids = set(ids)
+        transaction.on_commit(
+            lambda: self._apply(model, user_id, ids, added))
+
+    def _apply(self, model, user_id, ids, added):
+        version = bump_version(user_id)
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return
+            # Запись обновляется на месте, только если между её загрузкой
+            # и этим изменением версию никто не менял.
+            if (version is None or entry.version is None
+                    or version != entry.version + 1):
+                del self._entries[user_id]
+                return
+            values = getattr(entry, SOURCES[model][0])
+            if added:
+                values.update(ids)
+            else:
+                values.difference_update(ids)
+            entry.version = version
+
+    def invalidate(self, user_ids):
+        """Сбрасывает признаки пользователей во всех процессах, например
+        после вставки связей в обход сигналов."""
+        user_ids = list(user_ids)
+
+        def reset():
+            cache.delete_many(
+                [VERSION_KEY.format(user_id) for user_id in user_ids])
+            with self._lock:
+                for user_id in user_ids:
+                    self._entries.pop(user_id, None)
+
+        transaction.on_commit(reset)
+
+
+user_flags = UserFlagsCache()
+
+
+def get_for_request(request, recipes=None):
+    """Признаки пользователя запроса, None для анонимного. Версия
+    проверяется один раз за запрос.
+
+    Если кэш не общий, признаки читаются из базы, recipes — рецепты
+    страницы, которыми можно ограничить чтение.
+    """
+    if request is None or not request.user.is_authenticated:
+        return None
+    flags = getattr(request, '_user_flags', None)
+    if flags is None:
+        if response_cache.is_shared():
+            flags = user_flags.get(request.user.id)
+        else:
+            flags = UserFlags(request.user.id, None, recipes)
+        request._user_flags = flags
+    return flags
@@ -1,41 +1,101 @@
-from django.db.models import F, Sum
-from django.http import HttpResponse
+from io import BytesIO
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (BooleanField, Prefetch, Value,
+                              prefetch_related_objects)
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from rest_framework import filters, status, viewsets
+from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import (SAFE_METHODS, IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from weasyprint import HTML
 
-from .filters import IngredientSearchFilter, RecipeFilter
-from .pagination import CustomPagination
+from . import response_cache, shopping_list
+from .autocomplete import ingredient_index
+from .filters import COUNTER_ORDERINGS, ORDERINGS, RecipeFilter
+from .pagination import (CursorPaginationMixin, CustomPagination,
+                         FeedCursorPagination, RecipeCursorPagination,
+                         UserCursorPagination)
+from .response_cache import (INGREDIENTS, RECIPES, TAGS,
+                             CachedResponseMixin)
+from .renderers import CSVRenderer, PDFRenderer, PlainTextRenderer
 from .serializers import (CartSerializer, CreateRecipeSerializer,
                           FavoriteSerializer, FollowListSerializer,
                           FollowSerializer, IngredientSerializer,
-                          RecipeSerializer, TagsSerializer)
-from food.models import (Cart, Favorite, Ingredient, IngredientRecipe, Recipe,
+                          RecipeIdsSerializer, ShoppingListJobSerializer,
+                          TagsSerializer)
+from .snapshots import PantryRecipeSerializer, RecipeSnapshotSerializer
+from .user_flags import user_flags
+from food import counters, pantry, shopping_list_items, timeline
+from food.models import (Cart, Favorite, Ingredient, Recipe, ShoppingListJob,
                          Tag)
+from food.models.shopping_list import DONE, PENDING, RUNNING
 from users.models import Follow, User
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(CachedResponseMixin, CursorPaginationMixin,
+                    viewsets.ModelViewSet):
     """Вьюсет рецептов."""
     queryset = Recipe.objects.all()
     filter_backends = [DjangoFilterBackend]
-    serializer_class = RecipeSerializer
+    serializer_class = RecipeSnapshotSerializer
     filterset_class = RecipeFilter
     permission_classes = (IsAuthenticatedOrReadOnly,)
     pagination_class = CustomPagination
+    cursor_pagination_class = RecipeCursorPagination
+    cursor_actions = ('list', 'feed')
+    cache_scope = RECIPES
 
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
-            return RecipeSerializer
+            return RecipeSnapshotSerializer
         return CreateRecipeSerializer
 
+    def is_cacheable(self, request):
+        return super().is_cacheable(request) and (
+            request.query_params.get('ordering') not in COUNTER_ORDERINGS)
+
+    def update_cached_data(self, data):
+        """Счётчики избранного и корзин меняются без сброса кэша, их
+        значения берутся из базы одним запросом."""
+        recipes = data['results'] if 'results' in data else [data]
+        counts = {
+            pk: (favorites_count, in_carts_count)
+            for pk, favorites_count, in_carts_count
+            in Recipe.objects.filter(
+                pk__in=[recipe['id'] for recipe in recipes]
+            ).values_list('pk', 'favorites_count', 'in_carts_count')
+        }
+        for recipe in recipes:
+            if recipe['id'] in counts:
+                (recipe['favorites_count'],
+                 recipe['in_carts_count']) = counts[recipe['id']]
+        return data
+
+    def check_cursor_pagination(self):
+        super().check_cursor_pagination()
+        params = self.request.query_params
+        ordering = RecipeCursorPagination.ordering
+        if (params.get('search', '').strip()
+                or ORDERINGS.get(params.get('ordering'), ordering)
+                != ordering):
+            raise ValidationError({'pagination': (
+                'Курсорная пагинация идёт по дате публикации, с search и '
+                'ordering используйте постраничную.')})
+
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            instance.delete()
+            counters.change_author(instance.author_id, -1)
+
     @staticmethod
     def post_method_for_actions(request, pk, serializers):
         data = {'user': request.user.id, 'recipe': pk}
@@ -48,10 +108,141 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def delete_method_for_actions(request, pk, model):
         user = request.user
         recipe = get_object_or_404(Recipe, id=pk)
-        model_instance = get_object_or_404(model, user=user, recipe=recipe)
-        model_instance.delete()
+        with transaction.atomic():
+            # Та же блокировка, что при добавлении: из двух одновременных
+            # удалений счётчики и список покупок меняет только одно.
+            shopping_list_items.lock_users([user.id])
+            deleted, _ = model.objects.filter(
+                user=user, recipe=recipe).delete()
+            if not deleted:
+                return Response(
+                    {'errors': 'Рецепта нет в списке.'},
+                    status=status.HTTP_400_BAD_REQUEST)
+            counters.change_recipes(
+                (recipe.id,), counters.COUNTER_FIELDS[model], -1)
+            if model is Cart:
+                shopping_list_items.change_cart(user.id, (recipe.id,), -1)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @staticmethod
+    def get_bulk_ids(request):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return list(dict.fromkeys(serializer.validated_data['recipes']))
+
+    @staticmethod
+    def invalidate_for_actions(user, model, ids):
+        # bulk_create не отправляет сигналы, кэши сбрасываются явно.
+        response_cache.bump(user_ids=[user.id])
+        user_flags.change(model, user.id, ids, added=True)
+        if model is Cart:
+            transaction.on_commit(
+                lambda: shopping_list.invalidate([user.id]))
+
+    def bulk_post_method_for_actions(self, request, model):
+        """Добавляет пачку рецептов в избранное или корзину."""
+        user = request.user
+        ids = self.get_bulk_ids(request)
+        found = set(Recipe.objects.filter(pk__in=ids).values_list(
+            'pk', flat=True))
+        with transaction.atomic():
+            shopping_list_items.lock_users([user.id])
+            exists = set(model.objects.filter(
+                user=user, recipe_id__in=found
+            ).values_list('recipe_id', flat=True))
+            added = found - exists
+            model.objects.bulk_create(
+                [model(user=user, recipe_id=pk) for pk in added],
+                ignore_conflicts=True,
+            )
+            counters.change_recipes(
+                added, counters.COUNTER_FIELDS[model], 1)
+            if model is Cart:
+                shopping_list_items.change_cart(user.id, added, 1)
+            if added:
+                self.invalidate_for_actions(user, model, added)
+        results = []
+        for pk in ids:
+            if pk in added:
+                result = 'added'
+            elif pk in exists:
+                result = 'exists'
+            else:
+                result = 'not_found'
+            results.append({'id': pk, 'status': result})
+        return Response({'results': results})
+
+    def bulk_delete_method_for_actions(self, request, model, ids=None):
+        """Удаляет пачку рецептов из избранного или корзины одним
+        запросом; без ids удаляет все."""
+        user = request.user
+        with transaction.atomic():
+            rows = model.objects.select_for_update().filter(user=user)
+            if ids is not None:
+                rows = rows.filter(recipe_id__in=ids)
+            removed = set(rows.values_list('recipe_id', flat=True))
+            model.objects.filter(user=user, recipe_id__in=removed).delete()
+            counters.change_recipes(
+                removed, counters.COUNTER_FIELDS[model], -1)
+            if model is Cart:
+                shopping_list_items.change_cart(user.id, removed, -1)
+        if ids is None:
+            ids = sorted(removed)
+        return Response({'results': [
+            {'id': pk, 'status': 'removed' if pk in removed else 'not_found'}
+            for pk in ids
+        ]})
+
+    @action(detail=False, methods=['get'], url_path='pantry')
+    def recipes_from_pantry(self, request):
+        """Рецепты, которые можно приготовить из переданных ингредиентов,
+        по убыванию доли имеющихся ингредиентов."""
+        ingredient_ids = [
+            value
+            for values in request.query_params.getlist('ingredients')
+            for value in values.split(',') if value
+        ]
+        if not ingredient_ids or not all(
+                value.isdigit() for value in ingredient_ids):
+            raise ValidationError(
+                {'ingredients': 'Укажите id ингредиентов через запятую.'})
+        ingredient_ids = set(map(int, ingredient_ids))
+        if len(ingredient_ids) > settings.PANTRY_MAX_INGREDIENTS:
+            raise ValidationError({'ingredients': (
+                f'Не больше {settings.PANTRY_MAX_INGREDIENTS} '
+                'ингредиентов за запрос.')})
+        page = self.paginate_queryset(pantry.find_recipes(ingredient_ids))
+        recipes = Recipe.objects.in_bulk([row['recipe'] for row in page])
+        result = []
+        for row in page:
+            recipe = recipes.get(row['recipe'])
+            if recipe is not None:
+                recipe.found_ingredients = row['found']
+                recipe.missing_ingredients = row['total'] - row['found']
+                result.append(recipe)
+        serializer = PantryRecipeSerializer(
+            result, many=True, context={'request': request})
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'],
+            permission_classes=(IsAuthenticated,),
+            cursor_pagination_class=FeedCursorPagination)
+    def feed(self, request):
+        """Рецепты авторов, на которых подписан пользователь, сначала
+        новые. Фильтры те же, что у списка рецептов.
+
+        Без фильтров лента листается по записям TimelineEntry, рецепты
+        загружаются только для страницы.
+        """
+        recipes = None
+        if set(request.query_params) & set(RecipeFilter.base_filters):
+            recipes = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(
+            timeline.get_feed(request.user, recipes))
+        serializer = self.get_serializer(
+            timeline.load_recipes(page), many=True)
+        return self.get_paginated_response(serializer.data)
+
     @action(detail=True, methods=['post'])
     def shopping_cart(self, request, pk):
         return self.post_method_for_actions(
@@ -59,31 +250,105 @@ class RecipeViewSet(viewsets.ModelViewSet):
         )
 
     @action(
-        detail=False, methods=['get'], permission_classes=(IsAuthenticated,)
+        detail=False, methods=['get'], permission_classes=(IsAuthenticated,),
+        renderer_classes=(PDFRenderer, PlainTextRenderer, CSVRenderer,
+                          JSONRenderer)
     )
     def download_shopping_cart(self, request):
-        shopping_list = IngredientRecipe.objects.filter(
-            recipe__shopping_cart__user=request.user
-        ).values(
-            name=F('ingredient__name'),
-            measurement_unit=F('ingredient__measurement_unit')
-        ).annotate(amount_sum=Sum('amount')).values_list(
-            'ingredient__name', 'amount_sum', 'ingredient__measurement_unit'
-        )
-        html_template = render_to_string('recipes/pdf_template.html',
-                                         {'ingredients': shopping_list})
-        html = HTML(string=html_template)
-        result = html.write_pdf()
-        response = HttpResponse(result, content_type='application/pdf;')
-        response['Content-Disposition'] = 'inline; filename=shopping_list.pdf'
-        response['Content-Transfer-Encoding'] = 'binary'
+        file_format = request.accepted_renderer.format
+        if file_format in shopping_list.STREAM_FORMATS:
+            stream, content_type = shopping_list.STREAM_FORMATS[file_format]
+            response = StreamingHttpResponse(
+                stream(shopping_list.get_shopping_list_queryset(
+                    request.user).iterator()),
+                content_type=content_type,
+            )
+            response['Content-Disposition'] = (
+                f'attachment; filename="shopping_list.{file_format}"')
+            return response
+        items = shopping_list.get_shopping_list(request.user)
+        digest = shopping_list.get_digest(items)
+        etag = quote_etag(digest)
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = FileResponse(
+                BytesIO(shopping_list.get_pdf(request.user, items, digest)),
+                content_type='application/pdf',
+                filename='shopping_list.pdf',
+            )
+        response['ETag'] = etag
+        response['Cache-Control'] = 'private, no-cache'
         return response
 
+    @action(
+        detail=False, methods=['post'], permission_classes=(IsAuthenticated,),
+        url_path='download_shopping_cart/jobs'
+    )
+    def shopping_list_jobs(self, request):
+        items = shopping_list.get_shopping_list(request.user)
+        digest = shopping_list.get_digest(items)
+        job = ShoppingListJob.objects.filter(
+            user=request.user,
+            digest=digest,
+            status__in=(PENDING, RUNNING, DONE),
+        ).last()
+        if job is None:
+            job = ShoppingListJob.objects.create(
+                user=request.user, digest=digest, items=items)
+        serializer = ShoppingListJobSerializer(
+            job, context={'request': request})
+        response = Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+        if job.status != DONE:
+            response['Retry-After'] = settings.SHOPPING_LIST_RETRY_AFTER
+        return response
+
+    @action(
+        detail=False, methods=['get'], permission_classes=(IsAuthenticated,),
+        url_path=r'download_shopping_cart/jobs/(?P<job_id>[0-9a-f-]{36})'
+    )
+    def shopping_list_job(self, request, job_id):
+        """Статус задания. Ответ не ждёт готовности, чтобы не занимать
+        процесс веб-сервера: пока список формируется, Retry-After
+        подсказывает, когда спросить снова."""
+        job = get_object_or_404(ShoppingListJob, pk=job_id, user=request.user)
+        serializer = ShoppingListJobSerializer(
+            job, context={'request': request})
+        response = Response(serializer.data)
+        if job.status in (PENDING, RUNNING):
+            response['Retry-After'] = settings.SHOPPING_LIST_RETRY_AFTER
+        return response
+
+    @action(
+        detail=False, methods=['get'], permission_classes=(IsAuthenticated,),
+        url_path=r'download_shopping_cart/jobs/(?P<job_id>[0-9a-f-]{36})/file'
+    )
+    def shopping_list_job_file(self, request, job_id):
+        job = get_object_or_404(
+            ShoppingListJob, pk=job_id, user=request.user, status=DONE)
+        return FileResponse(
+            job.file.open('rb'),
+            content_type='application/pdf',
+            filename='shopping_list.pdf',
+        )
+
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk):
         return self.delete_method_for_actions(
             request=request, pk=pk, model=Cart)
 
+    @action(detail=False, methods=['post'], url_path='shopping_cart/bulk')
+    def shopping_cart_bulk(self, request):
+        return self.bulk_post_method_for_actions(request, Cart)
+
+    @shopping_cart_bulk.mapping.delete
+    def delete_shopping_cart_bulk(self, request):
+        return self.bulk_delete_method_for_actions(
+            request, Cart, self.get_bulk_ids(request))
+
+    @action(detail=False, methods=['delete'], url_path='shopping_cart/clear')
+    def clear_shopping_cart(self, request):
+        return self.bulk_delete_method_for_actions(request, Cart)
+
     @action(detail=True, methods=['post'])
     def favorite(self, request, pk):
         return self.post_method_for_actions(
@@ -94,10 +359,21 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return self.delete_method_for_actions(
             request=request, pk=pk, model=Favorite)
 
+    @action(detail=False, methods=['post'], url_path='favorite/bulk')
+    def favorite_bulk(self, request):
+        return self.bulk_post_method_for_actions(request, Favorite)
+
+    @favorite_bulk.mapping.delete
+    def delete_favorite_bulk(self, request):
+        return self.bulk_delete_method_for_actions(
+            request, Favorite, self.get_bulk_ids(request))
 
-class CustomUserViewSet(UserViewSet):
+
+class CustomUserViewSet(CursorPaginationMixin, UserViewSet):
     """Вьюсет User."""
     pagination_class = CustomPagination
+    cursor_pagination_class = UserCursorPagination
+    cursor_actions = ('list', 'subscriptions')
 
     @action(['get'], detail=False, permission_classes=[IsAuthenticated])
     def me(self, request, *args, **kwargs):
@@ -107,7 +383,22 @@ class CustomUserViewSet(UserViewSet):
     @action(methods=['get'], detail=False)
     def subscriptions(self, request):
         subscriptions_list = self.paginate_queryset(
-            User.objects.filter(following__user=request.user))
+            User.objects.filter(following__user=request.user).annotate(
+                is_subscribed=Value(True, output_field=BooleanField()),
+            )
+        )
+        recipes = Recipe.objects.filter(author__in=subscriptions_list)
+        recipes_limit = request.query_params.get('recipes_limit')
+        if recipes_limit:
+            if not recipes_limit.isdigit():
+                raise ValidationError(
+                    {'recipes_limit': 'Укажите целое неотрицательное число.'})
+            recipes = recipes.limited_per_author(int(recipes_limit))
+        prefetch_related_objects(subscriptions_list, Prefetch(
+            'recipes',
+            queryset=recipes.order_by('-pub_date', '-pk'),
+            to_attr='limited_recipes',
+        ))
         serializer = FollowListSerializer(
             subscriptions_list, many=True, context={
                 'request': request
@@ -123,7 +414,10 @@ class CustomUserViewSet(UserViewSet):
                 author=get_object_or_404(User, id=id),
                 user=request.user
             )
-            self.perform_destroy(subscription)
+            with transaction.atomic():
+                self.perform_destroy(subscription)
+                counters.change_followers(subscription.author_id, -1)
+                timeline.unfollow(request.user.id, subscription.author_id)
             return Response(status=status.HTTP_204_NO_CONTENT)
         serializer = FollowSerializer(
             data={
@@ -137,20 +431,46 @@ class CustomUserViewSet(UserViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class TagsViewSet(viewsets.ModelViewSet):
+class TagsViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     """Вьюсет Тегов."""
     queryset = Tag.objects.all()
     serializer_class = TagsSerializer
     pagination_class = None
+    cache_scope = TAGS
     permission_classes = (IsAuthenticatedOrReadOnly,)
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(CachedResponseMixin, viewsets.ModelViewSet):
+    """Вьюсет ингредиентов.
+
+    Поиск по началу названия (?name=) обслуживается индексом в памяти.
+    """
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (IsAuthenticatedOrReadOnly,)
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter,)
-    filterset_class = IngredientSearchFilter
     pagination_class = None
-    filterset_fields = ('name',)
-    search_fields = ('^name',)
+    cache_scope = INGREDIENTS
+
+    @staticmethod
+    def get_limit(request, default):
+        limit = request.query_params.get('limit')
+        if limit is None:
+            return default
+        if not limit.isdigit():
+            raise ValidationError({'limit': 'Укажите целое число.'})
+        return min(int(limit), settings.INGREDIENT_AUTOCOMPLETE_MAX_LIMIT)
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name is None:
+            return super().list(request, *args, **kwargs)
+        return Response(ingredient_index.search(
+            name, self.get_limit(request, default=None)))
+
+    @action(detail=False, methods=['get'])
+    def autocomplete(self, request):
+        return Response(ingredient_index.search(
+            request.query_params.get('name', ''),
+            self.get_limit(
+                request, default=settings.INGREDIENT_AUTOCOMPLETE_LIMIT),
+        ))
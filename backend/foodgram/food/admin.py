@@ -4,13 +4,29 @@ from .models import Ingredient, IngredientRecipe, Recipe, Tag
 
 
 class PostAdmin(admin.ModelAdmin):
-    list_display = ('pk', 'text', 'pub_date', 'author')
+    list_display = ('pk', 'text', 'pub_date', 'author', 'favorites_count')
     search_fields = ('text',)
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
 
+class IngredientRecipeAdmin(admin.ModelAdmin):
+    """Только просмотр: состав рецепта меняется через API, которое
+    обновляет списки покупок и число ингредиентов рецепта."""
+    list_display = ('pk', 'recipe', 'ingredient', 'amount')
+    list_select_related = ('recipe', 'ingredient')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
 admin.site.register(Recipe, PostAdmin)
 admin.site.register(Tag)
-admin.site.register(IngredientRecipe)
+admin.site.register(IngredientRecipe, IngredientRecipeAdmin)
 admin.site.register(Ingredient)
@@ -0,0 +1,64 @@
+"""Денормализованные счётчики избранного, корзин, рецептов и подписчиков
+автора.
+
+Счётчики меняются F-выражениями в момент создания и удаления записей,
+поэтому одновременные запросы не теряют обновлений. Если значения всё же
+разошлись с данными (например, после каскадного удаления пользователя),
+их исправляет команда reconcile_counters.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from food.models import Cart, Favorite, Recipe
+from users.models import Follow, User
+
+FAVORITES = 'favorites_count'
+CARTS = 'in_carts_count'
+RECIPES = 'recipes_count'
+FOLLOWERS = 'followers_count'
+
+COUNTER_FIELDS = {
+    Favorite: FAVORITES,
+    Cart: CARTS,
+}
+
+
+def change(queryset, field, delta):
+    """Атомарно меняет счётчик field у записей queryset на delta."""
+    return queryset.update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def change_recipes(recipe_ids, field, delta):
+    return change(Recipe.objects.filter(pk__in=recipe_ids), field, delta)
+
+
+def change_author(author_id, delta):
+    return change(User.objects.filter(pk=author_id), RECIPES, delta)
+
+
+def change_followers(author_id, delta):
+    return change(User.objects.filter(pk=author_id), FOLLOWERS, delta)
+
+
+def count_subquery(model, field):
+    """Подзапрос с числом записей model, ссылающихся на внешнюю строку."""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by()
+        .values(field).annotate(total=Count('pk')).values('total'),
+        output_field=IntegerField(),
+    ), 0)
+
+
+def reconcile():
+    """Пересчитывает разошедшиеся счётчики, возвращает число исправлений."""
+    fixed = {}
+    for queryset, field, model, fk in (
+        (Recipe.objects.all(), FAVORITES, Favorite, 'recipe'),
+        (Recipe.objects.all(), CARTS, Cart, 'recipe'),
+        (User.objects.all(), RECIPES, Recipe, 'author'),
+        (User.objects.all(), FOLLOWERS, Follow, 'author'),
+    ):
+        actual = count_subquery(model, fk)
+        fixed[field] = queryset.filter(
+            ~Q(**{field: actual})).update(**{field: actual})
+    return fixed
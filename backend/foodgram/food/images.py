@@ -0,0 +1,121 @@
+"""Уменьшенные копии картинок рецептов.
+
+Оригинал сохраняется как есть, а копии фиксированной ширины в WebP и
+JPEG строит сервис image_worker (команда render_image_variants) по
+заданиям RecipeImageJob, которые ставятся в очередь в той же
+транзакции, что и сохранение рецепта. Имена копий содержат хеш
+оригинала, поэтому их можно кэшировать навсегда. В Recipe.image_variants
+хранятся пары [ширина, имя файла] для каждого формата.
+"""
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+
+from food.models import Recipe, RecipeImageJob
+from food.models.shopping_list import PENDING
+from food.storage import DIGEST_LENGTH
+
+VARIANTS_DIR = 'recipe/variants/'
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+
+def schedule(recipe_id, force=False):
+    """Ставит построение копий в очередь, если рецепт ещё не ждёт
+    обработки. Задание видно обработчику после фиксации транзакции."""
+    pending = RecipeImageJob.objects.filter(
+        recipe_id=recipe_id, status=PENDING)
+    if force:
+        pending = pending.filter(force=True)
+    if not pending.exists():
+        RecipeImageJob.objects.create(recipe_id=recipe_id, force=force)
+
+
+def encode(image, width, image_format, options):
+    height = max(1, round(image.height * width / image.width))
+    if (width, height) != image.size:
+        image = image.resize((width, height), Image.Resampling.LANCZOS,
+                             reducing_gap=3.0)
+    if image_format == 'JPEG' and image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def find_variants(recipe_id, force=False):
+    """Имя картинки рецепта и готовые копии той же картинки у другого
+    рецепта. Копии не ищутся, если передан force; (None, None) — у
+    рецепта нет картинки."""
+    recipe = Recipe.objects.filter(pk=recipe_id).only('image').first()
+    if recipe is None or not recipe.image:
+        return None, None
+    name = recipe.image.name
+    if force:
+        return name, None
+    return name, Recipe.objects.filter(image=name).exclude(
+        image_variants={}
+    ).values_list('image_variants', flat=True).first()
+
+
+def save_variants(recipe_id, name, variants):
+    """Сохраняет копии, если картинка рецепта за это время не
+    сменилась."""
+    with transaction.atomic():
+        recipe = Recipe.objects.select_for_update().filter(
+            pk=recipe_id, image=name).first()
+        if recipe is None:
+            return None
+        recipe.image_variants = variants
+        recipe.save(update_fields=('image_variants',))
+    return variants
+
+
+def build_variants(recipe_id, force=False):
+    """Строит копии картинки рецепта в текущем процессе и сохраняет их
+    имена.
+
+    Если у другого рецепта та же картинка, его копии используются
+    повторно, если не передан force.
+    """
+    name, variants = find_variants(recipe_id, force)
+    if name is None:
+        return None
+    if variants is None:
+        variants = encode_variants(name)
+    return save_variants(recipe_id, name, variants)
+
+
+def encode_variants(name):
+    """Строит копии картинки name. Не обращается к базе, поэтому
+    выполняется в пуле процессов обработчика очереди."""
+    with Recipe._meta.get_field('image').storage.open(name, 'rb') as file:
+        content = file.read()
+    digest = hashlib.sha256(content).hexdigest()[:DIGEST_LENGTH]
+    image = ImageOps.exif_transpose(Image.open(BytesIO(content)))
+    if image.mode not in ('RGB', 'RGBA'):
+        has_alpha = ('A' in image.getbands()
+                     or 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+    widths = sorted({
+        min(width, image.width) for width in settings.RECIPE_IMAGE_WIDTHS
+    })
+    variants = {}
+    for extension, (image_format, options) in FORMATS.items():
+        variants[extension] = []
+        for width in widths:
+            variant = f'{VARIANTS_DIR}{digest}-{width}.{extension}'
+            if not default_storage.exists(variant):
+                default_storage.save(variant, ContentFile(
+                    encode(image, width, image_format, options)))
+            variants[extension].append([width, variant])
+    return variants
@@ -0,0 +1,32 @@
+"""Очереди фоновых заданий в базе.
+
+Обработчик забирает задания с SELECT ... FOR UPDATE SKIP LOCKED, поэтому
+несколько обработчиков не получат одно задание. Задание, которое
+слишком долго остаётся в работе (обработчик упал), возвращается в
+очередь.
+"""
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from food.models.shopping_list import PENDING, RUNNING
+
+
+def claim(model, limit, timeout):
+    """Забирает из очереди model не больше limit заданий. Задания,
+    начатые раньше чем timeout секунд назад, возвращаются в очередь."""
+    if limit <= 0:
+        return []
+    model.objects.filter(
+        status=RUNNING,
+        started__lt=timezone.now() - timedelta(seconds=timeout),
+    ).update(status=PENDING)
+    with transaction.atomic():
+        jobs = list(model.objects.select_for_update(
+            skip_locked=True
+        ).filter(status=PENDING)[:limit])
+        model.objects.filter(
+            pk__in=[job.pk for job in jobs]
+        ).update(status=RUNNING, started=timezone.now())
+    return jobs
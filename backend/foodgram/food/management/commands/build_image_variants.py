@@ -0,0 +1,25 @@
+from django.core.management import BaseCommand
+
+from food import images
+from food.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Ставит в очередь построение уменьшенных копий картинок '
+            'рецептов, у которых их ещё нет. Копии строит команда '
+            'render_image_variants.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересобрать копии для всех рецептов.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        recipe_ids = list(recipes.values_list('id', flat=True))
+        for recipe_id in recipe_ids:
+            images.schedule(recipe_id, force=options['all'])
+        self.stdout.write(
+            f'Поставлено в очередь картинок рецептов: {len(recipe_ids)}.')
@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand, CommandError
+
+from food import shopping_list_items
+
+
+class Command(BaseCommand):
+    help = ('Сверяет материализованные списки покупок с корзинами и '
+            'составами рецептов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix', action='store_true',
+            help='Пересчитать списки пользователей с расхождениями.')
+
+    def handle(self, *args, **options):
+        drift = shopping_list_items.check(fix=options['fix'])
+        if not drift:
+            self.stdout.write('Расхождений нет.')
+            return
+        for user_id, rows in sorted(drift.items()):
+            self.stdout.write(
+                f'Пользователь {user_id}: неверных строк — {rows}.')
+        if not options['fix']:
+            raise CommandError(
+                f'Расхождения у пользователей: {len(drift)}.')
+        self.stdout.write(f'Пересчитаны списки пользователей: {len(drift)}.')
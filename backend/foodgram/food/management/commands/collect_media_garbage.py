@@ -0,0 +1,57 @@
+import posixpath
+from datetime import timedelta
+
+from django.core.management import BaseCommand
+from django.db.models import Count
+from django.template.defaultfilters import filesizeformat
+from django.utils import timezone
+
+from food.images import VARIANTS_DIR
+from food.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки рецептов и их копии, на которые не ссылается '
+            'ни один рецепт.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-hours', type=int, default=24,
+            help='Не трогать файлы моложе указанного числа часов.')
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, что будет удалено.')
+
+    def get_references(self):
+        """Число рецептов, ссылающихся на каждый файл."""
+        references = dict(Recipe.objects.exclude(image='').values(
+            'image').annotate(total=Count('pk')).values_list(
+            'image', 'total'))
+        for variants in Recipe.objects.exclude(image_variants={}).values_list(
+                'image_variants', flat=True).iterator():
+            for files in variants.values():
+                for _, name in files:
+                    references[name] = references.get(name, 0) + 1
+        return references
+
+    def handle(self, *args, **options):
+        storage = Recipe._meta.get_field('image').storage
+        upload_to = Recipe._meta.get_field('image').upload_to
+        deadline = timezone.now() - timedelta(hours=options['grace_hours'])
+        references = self.get_references()
+        removed = freed = 0
+        for directory in (upload_to, VARIANTS_DIR):
+            if not storage.exists(directory):
+                continue
+            for filename in storage.listdir(directory)[1]:
+                name = posixpath.join(directory, filename)
+                if (references.get(name)
+                        or storage.get_modified_time(name) > deadline):
+                    continue
+                removed += 1
+                freed += storage.size(name)
+                if not options['dry_run']:
+                    storage.delete(name)
+        self.stdout.write(
+            f'Файлов без ссылок: {removed}, '
+            f'освобождено {filesizeformat(freed)}.')
@@ -0,0 +1,231 @@
+import random
+from datetime import timedelta
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from api import response_cache, snapshots
+from api.user_flags import user_flags
+from food import counters, pantry, timeline
+from food.models import (Cart, Favorite, Ingredient, IngredientRecipe, Recipe,
+                         ShoppingListItem, Tag)
+from food.shopping_list_items import get_live_totals
+from users.models import Follow, User
+
+DISHES = ('суп', 'салат', 'пирог', 'рагу', 'омлет', 'плов', 'запеканка',
+          'каша', 'паста', 'котлеты', 'блины', 'жаркое')
+STYLES = ('домашний', 'быстрый', 'праздничный', 'летний', 'острый',
+          'постный', 'бабушкин', 'сытный')
+UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+COLORS = ('#E26C2D', '#49B64E', '#8775D2', '#F5C518', '#2D9CDB')
+DAYS = 365
+
+
+def next_id(model):
+    return (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+
+
+def popularity(count, skew):
+    """Накопленные веса закона Ципфа: первые объекты встречаются
+    намного чаще остальных, как популярные авторы и рецепты."""
+    return list(accumulate(1 / (rank + 1) ** skew for rank in range(count)))
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, рецептами, '
+            'подписками, избранным и корзинами для нагрузочных тестов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--recipes', type=int, default=5000)
+        parser.add_argument(
+            '--ingredients', type=int, default=2000,
+            help='Сколько ингредиентов должно быть в базе, недостающие '
+                 'создаются.')
+        parser.add_argument('--tags', type=int, default=10)
+        parser.add_argument(
+            '--recipe-ingredients', type=int, nargs=2, default=(3, 15),
+            metavar=('MIN', 'MAX'),
+            help='Число ингредиентов в рецепте.')
+        parser.add_argument(
+            '--follows', type=int, default=20,
+            help='Среднее число подписок пользователя.')
+        parser.add_argument(
+            '--favorites', type=int, default=30,
+            help='Среднее число избранных рецептов пользователя.')
+        parser.add_argument(
+            '--carts', type=int, default=5,
+            help='Среднее число рецептов в корзине пользователя.')
+        parser.add_argument(
+            '--skew', type=float, default=1.1,
+            help='Показатель закона Ципфа для популярности авторов и '
+                 'рецептов.')
+        parser.add_argument(
+            '--seed', type=int, default=1,
+            help='Зерно генератора: одинаковые параметры дают одинаковые '
+                 'данные.')
+        parser.add_argument(
+            '--prefix', default='fake',
+            help='Префикс имён и почт создаваемых пользователей.')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        with transaction.atomic():
+            ingredient_ids = self.create_ingredients(options['ingredients'])
+            tag_ids = self.create_tags(options['tags'])
+            user_ids = self.create_users(options['users'], options['prefix'])
+            recipe_ids = self.create_recipes(
+                options['recipes'], user_ids, options['skew'])
+            self.create_recipe_rows(
+                recipe_ids, ingredient_ids, tag_ids,
+                options['recipe_ingredients'])
+            follows = self.create_user_rows(
+                Follow, 'author_id', user_ids, user_ids,
+                options['follows'], options['skew'])
+            favorites = self.create_user_rows(
+                Favorite, 'recipe_id', user_ids, recipe_ids,
+                options['favorites'], options['skew'])
+            carts = self.create_user_rows(
+                Cart, 'recipe_id', user_ids, recipe_ids,
+                options['carts'], options['skew'])
+            self.reset_sequences()
+            self.update_derived_data(user_ids, recipe_ids)
+        self.stdout.write(
+            f'Создано пользователей: {len(user_ids)}, '
+            f'рецептов: {len(recipe_ids)}, подписок: {follows}, '
+            f'в избранном: {favorites}, в корзинах: {carts}.')
+
+    def bulk_create(self, model, objects):
+        model.objects.bulk_create(objects, batch_size=self.batch_size)
+
+    def create_ingredients(self, count):
+        existing = list(Ingredient.objects.values_list('pk', flat=True))
+        start = next_id(Ingredient)
+        created = [
+            Ingredient(pk=start + number,
+                       name=f'ингредиент {start + number}',
+                       measurement_unit=self.random.choice(UNITS))
+            for number in range(max(count - len(existing), 0))
+        ]
+        self.bulk_create(Ingredient, created)
+        return existing + [ingredient.pk for ingredient in created]
+
+    def create_tags(self, count):
+        existing = list(Tag.objects.values_list('pk', flat=True))
+        start = next_id(Tag)
+        created = [
+            Tag(pk=start + number, name=f'Тег {start + number}',
+                color=COLORS[number % len(COLORS)],
+                slug=f'tag-{start + number}')
+            for number in range(max(count - len(existing), 0))
+        ]
+        self.bulk_create(Tag, created)
+        return existing + [tag.pk for tag in created]
+
+    def create_users(self, count, prefix):
+        start = next_id(User)
+        password = make_password(None)
+        users = [
+            User(pk=start + number, username=f'{prefix}{start + number}',
+                 email=f'{prefix}{start + number}@example.com',
+                 first_name='Имя', last_name='Фамилия', password=password)
+            for number in range(count)
+        ]
+        self.bulk_create(User, users)
+        return [user.pk for user in users]
+
+    def create_recipes(self, count, author_ids, skew):
+        start = next_id(Recipe)
+        weights = popularity(len(author_ids), skew)
+        authors = self.random.choices(author_ids, cum_weights=weights, k=count)
+        now = timezone.now()
+        recipes = [
+            Recipe(pk=start + number, author_id=author_id,
+                   name=(f'{self.random.choice(STYLES).capitalize()} '
+                         f'{self.random.choice(DISHES)} №{start + number}'),
+                   text='Смешать, довести до готовности и подать.',
+                   cooking_time=self.random.randint(5, 180))
+            for number, author_id in enumerate(authors)
+        ]
+        self.bulk_create(Recipe, recipes)
+        # auto_now_add не даёт задать дату при вставке.
+        for recipe in recipes:
+            recipe.pub_date = now - timedelta(
+                seconds=self.random.randrange(DAYS * 24 * 60 * 60))
+        Recipe.objects.bulk_update(
+            recipes, ('pub_date',), batch_size=self.batch_size)
+        return [recipe.pk for recipe in recipes]
+
+    def create_recipe_rows(self, recipe_ids, ingredient_ids, tag_ids,
+                           ingredients_range):
+        low, high = ingredients_range
+        ingredients = []
+        tags = []
+        for recipe_id in recipe_ids:
+            for ingredient_id in self.random.sample(
+                    ingredient_ids,
+                    min(self.random.randint(low, high), len(ingredient_ids))):
+                ingredients.append(IngredientRecipe(
+                    recipe_id=recipe_id, ingredient_id=ingredient_id,
+                    amount=self.random.randint(1, 500)))
+            for tag_id in self.random.sample(
+                    tag_ids, min(self.random.randint(1, 3), len(tag_ids))):
+                tags.append(Recipe.tags.through(
+                    recipe_id=recipe_id, tag_id=tag_id))
+        self.bulk_create(IngredientRecipe, ingredients)
+        self.bulk_create(Recipe.tags.through, tags)
+
+    def create_user_rows(self, model, field, user_ids, target_ids, average,
+                         skew):
+        """Связи пользователей с авторами или рецептами: число связей
+        у пользователя случайное, популярные цели выбираются чаще."""
+        if not target_ids or not average:
+            return 0
+        weights = popularity(len(target_ids), skew)
+        rows = []
+        for user_id in user_ids:
+            count = min(self.random.randint(0, 2 * average), len(target_ids))
+            targets = set(self.random.choices(
+                target_ids, cum_weights=weights, k=count))
+            if model is Follow:
+                targets.discard(user_id)
+            rows.extend(model(user_id=user_id, **{field: target_id})
+                        for target_id in targets)
+        self.bulk_create(model, rows)
+        return len(rows)
+
+    @staticmethod
+    def reset_sequences():
+        """Записи вставлены с явными id, сдвигаем последовательности."""
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(
+                    no_style(), [Ingredient, Tag, User, Recipe]):
+                cursor.execute(sql)
+
+    def update_derived_data(self, user_ids, recipe_ids):
+        """bulk_create не вызывает сигналов и не обновляет счётчики,
+        число ингредиентов рецептов, снимки рецептов, списки покупок,
+        ленты подписок и признаки пользователей в памяти процессов,
+        пересчитываем их целиком."""
+        counters.reconcile()
+        pantry.rebuild()
+        snapshots.refresh_ids(recipe_ids)
+        timeline.rebuild(user_ids)
+        for start in range(0, len(user_ids), self.batch_size):
+            self.bulk_create(ShoppingListItem, [
+                ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                                 amount=amount)
+                for (user_id, ingredient_id), amount in get_live_totals(
+                    user_ids[start:start + self.batch_size]).items()
+            ])
+        response_cache.bump(
+            response_cache.RECIPES, response_cache.TAGS,
+            response_cache.INGREDIENTS)
+        user_flags.invalidate(user_ids)
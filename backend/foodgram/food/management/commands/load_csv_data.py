@@ -1,20 +1,158 @@
+import csv
+import json
+import time
 from csv import DictReader
-from os.path import exists
+from io import StringIO
+from itertools import islice
+from os.path import exists, join, splitext
 
-from django.core.management import BaseCommand
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api import response_cache
+from api.autocomplete import ingredient_index
 from food.models import Ingredient
 
+DEFAULT_FILE = join(settings.BASE_DIR, 'static', 'data', 'ingredients.csv')
+JSON_READ_SIZE = 1 << 16
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    chunk = list(islice(rows, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(rows, size))
+
+
+def iter_json_array(file):
+    """Разбирает JSON-список объектов по одному, читая файл частями."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(JSON_READ_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('JSON-файл должен содержать список объектов.')
+    buffer = buffer[1:]
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(','):
+            buffer = buffer[1:].lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            record, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(JSON_READ_SIZE)
+            if not chunk:
+                raise CommandError('JSON-файл оборван или повреждён.')
+            buffer += chunk
+            continue
+        yield record
+        buffer = buffer[end:]
+
+
+def iter_json_lines(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+READERS = {
+    '.csv': DictReader,
+    '.json': iter_json_array,
+    '.jsonl': iter_json_lines,
+}
+
 
 class Command(BaseCommand):
+    help = ('Загружает ингредиенты из CSV или JSON. Повторный запуск не '
+            'создаёт дубликатов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=DEFAULT_FILE,
+            help='Файл .csv с колонками name и measurement_unit, '
+                 '.json со списком объектов с этими ключами или .jsonl '
+                 'с объектом в каждой строке.')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Сколько строк записывать за один запрос.')
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Не использовать COPY даже на PostgreSQL.')
+
     def handle(self, *args, **options):
-        csv_file = 'static/data/ingredients.csv'
-        if exists(csv_file):
-            for row in DictReader(open(csv_file, encoding='utf-8')):
-                Ingredient.objects.create(
-                    name=row['name'],
-                    measurement_unit=row['measurement_unit'])
-        else:
-            print(
-                'Файл Ingredient.csv для заполнения '
+        path = options['path']
+        if not exists(path):
+            self.stderr.write(
+                f'Файл {path} для заполнения '
                 f'{Ingredient.__name__} отсутвует.')
-        print(f'{Ingredient.__name__}: новые объекты добавлены.')
+            return
+        started = time.perf_counter()
+        count_before = Ingredient.objects.count()
+        with open(path, encoding='utf-8') as file:
+            rows = self.read_rows(file, splitext(path)[1].lower())
+            chunks = chunked(rows, options['batch_size'])
+            with transaction.atomic():
+                if (connection.vendor == 'postgresql'
+                        and not options['no_copy']):
+                    total = self.copy(chunks)
+                else:
+                    total = self.bulk_create(chunks)
+        created = Ingredient.objects.count() - count_before
+        if created:
+            # bulk_create и COPY не отправляют сигналов. Индекс других
+            # процессов обновится через INGREDIENT_INDEX_TTL.
+            response_cache.bump(
+                response_cache.INGREDIENTS, response_cache.RECIPES)
+            ingredient_index.invalidate()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'{Ingredient.__name__}: прочитано {total}, добавлено '
+            f'{created} за {elapsed:.2f} с '
+            f'({total / elapsed:.0f} строк/с).')
+
+    @staticmethod
+    def read_rows(file, extension):
+        for record in READERS.get(extension, DictReader)(file):
+            name = record['name'].strip()
+            if name:
+                yield name, record['measurement_unit'].strip()
+
+    @staticmethod
+    def bulk_create(chunks):
+        total = 0
+        for chunk in chunks:
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=name, measurement_unit=measurement_unit)
+                 for name, measurement_unit in chunk],
+                ignore_conflicts=True,
+            )
+            total += len(chunk)
+        return total
+
+    @staticmethod
+    def copy(chunks):
+        """Загружает строки через COPY во временную таблицу и переносит
+        их одним INSERT ... ON CONFLICT DO NOTHING."""
+        total = 0
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE ingredient_import '
+                '(name varchar(200), measurement_unit varchar(200)) '
+                'ON COMMIT DROP')
+            for chunk in chunks:
+                buffer = StringIO()
+                csv.writer(buffer).writerows(chunk)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    'COPY ingredient_import (name, measurement_unit) '
+                    'FROM STDIN WITH (FORMAT csv)', buffer)
+                total += len(chunk)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit '
+                'FROM ingredient_import '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING')
+        return total
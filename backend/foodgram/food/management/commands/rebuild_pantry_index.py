@@ -0,0 +1,13 @@
+from django.core.management import BaseCommand
+
+from food import pantry
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает число ингредиентов рецептов для поиска по '
+            'продуктам.')
+
+    def handle(self, *args, **options):
+        count = pantry.rebuild()
+        self.stdout.write(f'Число ингредиентов пересчитано у {count} '
+                          'рецептов.')
@@ -0,0 +1,33 @@
+import time
+
+from django.conf import settings
+from django.core.management import BaseCommand
+
+from food import timeline
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает ленты подписок по таблице подписок.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, nargs='+',
+            help='id пользователей, по умолчанию — все.')
+        parser.add_argument(
+            '--trim', action='store_true',
+            help='Не пересобирать, только удалить записи сверх '
+                 'TIMELINE_SIZE.')
+        parser.add_argument(
+            '--forever', action='store_true',
+            help='С --trim: повторять каждые TIMELINE_TRIM_INTERVAL сек.')
+
+    def handle(self, *args, **options):
+        if options['trim']:
+            while True:
+                deleted = timeline.trim(options['users'])
+                self.stdout.write(f'Удалено записей лент: {deleted}.')
+                if not options['forever']:
+                    return
+                time.sleep(settings.TIMELINE_TRIM_INTERVAL)
+        count = timeline.rebuild(options['users'])
+        self.stdout.write(f'Пересобрано лент: {count}.')
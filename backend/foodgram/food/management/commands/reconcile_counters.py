@@ -0,0 +1,12 @@
+from django.core.management import BaseCommand
+
+from food import counters
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает счётчики избранного, корзин, рецептов и '
+            'подписчиков авторов, если они разошлись с данными.')
+
+    def handle(self, *args, **options):
+        for field, count in counters.reconcile().items():
+            self.stdout.write(f'{field}: исправлено записей — {count}.')
@@ -0,0 +1,105 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from food import images, jobs
+from food.models import RecipeImageJob
+from food.models.shopping_list import DONE, FAILED, PENDING, RUNNING
+
+CLEANUP_INTERVAL = 60 * 60
+
+
+class Command(BaseCommand):
+    help = ('Строит уменьшенные копии картинок рецептов из очереди заданий '
+            'в отдельном пуле процессов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int,
+            default=settings.RECIPE_IMAGE_WORKERS,
+            help='Число процессов, которые кодируют картинки.')
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Пауза между опросами очереди, сек.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Обработать очередь и завершиться.')
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        connections.close_all()
+        running = {}
+        cleaned_at = 0
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=django.setup) as pool:
+            while True:
+                if time.monotonic() - cleaned_at > CLEANUP_INTERVAL:
+                    self.cleanup()
+                    cleaned_at = time.monotonic()
+                claimed = jobs.claim(
+                    RecipeImageJob, workers - len(running),
+                    settings.RECIPE_IMAGE_JOB_TIMEOUT)
+                for job in claimed:
+                    self.start(pool, running, job)
+                if not running:
+                    # Задания могли завершиться без пула.
+                    if claimed:
+                        continue
+                    if options['once']:
+                        return
+                    time.sleep(options['poll_interval'])
+                    continue
+                done, _ = wait(running, timeout=options['poll_interval'],
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.finish(*running.pop(future), future)
+
+    def start(self, pool, running, job):
+        """Кодирует картинку в пуле процессов. Задание без картинки или
+        с готовыми копиями той же картинки завершается сразу."""
+        try:
+            name, variants = images.find_variants(job.recipe_id, job.force)
+            if name is not None and variants is not None:
+                images.save_variants(job.recipe_id, name, variants)
+        except Exception as error:
+            self.fail(job, error)
+            return
+        if name is None or variants is not None:
+            self.done(job)
+            return
+        running[pool.submit(images.encode_variants, name)] = job, name
+
+    def finish(self, job, name, future):
+        try:
+            images.save_variants(job.recipe_id, name, future.result())
+        except Exception as error:
+            self.fail(job, error)
+        else:
+            self.done(job)
+
+    @staticmethod
+    def done(job):
+        job.status = DONE
+        job.finished = timezone.now()
+        job.save(update_fields=('status', 'finished'))
+
+    def fail(self, job, error):
+        job.status = FAILED
+        job.error = repr(error)
+        job.finished = timezone.now()
+        job.save(update_fields=('status', 'error', 'finished'))
+        self.stderr.write(
+            f'Копии картинки рецепта {job.recipe_id}: {job.error}')
+
+    @staticmethod
+    def cleanup():
+        RecipeImageJob.objects.exclude(status__in=(PENDING, RUNNING)).filter(
+            created__lt=timezone.now() - timedelta(
+                seconds=settings.RECIPE_IMAGE_JOB_TTL)
+        ).delete()
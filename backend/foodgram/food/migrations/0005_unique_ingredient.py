@@ -0,0 +1,44 @@
+# Generated by Django 3.2 on 2026-10-18 16:49
+
+from django.db import migrations, models
+from django.db.models import Count, F, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Сливает повторно загруженные ингредиенты перед добавлением
+    ограничения уникальности."""
+    Ingredient = apps.get_model('food', 'Ingredient')
+    IngredientRecipe = apps.get_model('food', 'IngredientRecipe')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(keep_id=Min('id'), total=Count('id')).filter(total__gt=1)
+    for duplicate in duplicates:
+        extra = Ingredient.objects.filter(
+            name=duplicate['name'],
+            measurement_unit=duplicate['measurement_unit'],
+        ).exclude(id=duplicate['keep_id'])
+        for row in IngredientRecipe.objects.filter(ingredient__in=extra):
+            kept = IngredientRecipe.objects.filter(
+                recipe_id=row.recipe_id, ingredient_id=duplicate['keep_id'])
+            if kept.update(amount=F('amount') + row.amount):
+                row.delete()
+            else:
+                row.ingredient_id = duplicate['keep_id']
+                row.save(update_fields=('ingredient',))
+        extra.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0004_shoppinglistjob'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
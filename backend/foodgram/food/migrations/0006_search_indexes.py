@@ -0,0 +1,56 @@
+# Generated by Django 3.2 on 2026-10-18 16:51
+
+from django.db import migrations
+
+
+class PostgresRunSQL(migrations.RunSQL):
+    """GIN-индексы и pg_trgm есть только в PostgreSQL, на остальных СУБД
+    поиск работает без них.
+
+    Индексы не попадают в состояние моделей: иначе SQLite при следующей
+    перестройке таблицы попытался бы создать их заново.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state,
+                          to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(
+                app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state,
+                           to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(
+                app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0005_unique_ingredient'),
+    ]
+
+    operations = [
+        PostgresRunSQL(
+            'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+            migrations.RunSQL.noop,
+        ),
+        PostgresRunSQL(
+            'CREATE INDEX "ingredient_name_trgm_idx" ON "food_ingredient" '
+            'USING gin ("name" gin_trgm_ops)',
+            'DROP INDEX IF EXISTS "ingredient_name_trgm_idx"',
+        ),
+        # Выражение должно совпадать с food.models.recipe.SEARCH_VECTOR,
+        # иначе индекс не используется.
+        PostgresRunSQL(
+            'CREATE INDEX "recipe_search_vector_idx" ON "food_recipe" '
+            'USING gin ((to_tsvector(\'russian\'::regconfig, '
+            'COALESCE("name", \'\') || \' \' || COALESCE("text", \'\'))))',
+            'DROP INDEX IF EXISTS "recipe_search_vector_idx"',
+        ),
+        PostgresRunSQL(
+            'CREATE INDEX "recipe_name_trgm_idx" ON "food_recipe" '
+            'USING gin ("name" gin_trgm_ops)',
+            'DROP INDEX IF EXISTS "recipe_name_trgm_idx"',
+        ),
+    ]
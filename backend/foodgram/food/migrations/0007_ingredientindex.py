@@ -0,0 +1,54 @@
+# Generated by Django 3.2 on 2026-10-18 16:52
+
+import sys
+from array import array
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def build_ingredient_index(apps, schema_editor):
+    """Заполняет индекс по уже существующим рецептам, так же как
+    команда rebuild_pantry_index."""
+    IngredientIndex = apps.get_model('food', 'IngredientIndex')
+    IngredientRecipe = apps.get_model('food', 'IngredientRecipe')
+    totals = dict(IngredientRecipe.objects.values('recipe').annotate(
+        total=models.Count('id')).values_list('recipe', 'total'))
+    postings = defaultdict(dict)
+    for recipe_id, ingredient_id in IngredientRecipe.objects.values_list(
+            'recipe_id', 'ingredient_id').iterator():
+        postings[ingredient_id][recipe_id] = totals[recipe_id]
+    rows = []
+    for ingredient_id, recipes in postings.items():
+        packed = array('q')
+        for recipe_id in sorted(recipes):
+            packed.extend((recipe_id, recipes[recipe_id]))
+        if sys.byteorder == 'big':
+            packed.byteswap()
+        rows.append(IngredientIndex(
+            ingredient_id=ingredient_id, recipes=packed.tobytes()))
+    IngredientIndex.objects.bulk_create(rows, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0006_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngredientIndex',
+            fields=[
+                ('ingredient', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='index', serialize=False, to='food.ingredient')),
+                ('recipes', models.BinaryField(default=bytes)),
+            ],
+            options={
+                'verbose_name': 'Рецепты с ингредиентом',
+                'verbose_name_plural': 'Рецепты с ингредиентами',
+            },
+        ),
+        migrations.RunPython(
+            build_ingredient_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2 on 2026-10-18 17:01
+
+from django.db import migrations, models
+import food.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0010_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(blank=True, db_index=True, storage=food.storage.ContentAddressedStorage(), upload_to='recipe/', verbose_name='Картинка'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.2 on 2026-10-18 17:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0013_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='snapshot',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='Снимок представления'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='snapshot_generation',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Поколение снимка'),
+        ),
+    ]
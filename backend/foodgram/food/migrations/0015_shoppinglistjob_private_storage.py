@@ -0,0 +1,31 @@
+# Generated by Django 3.2 on 2026-10-18 17:38
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+import food.storage
+
+
+def remove_public_files(apps, schema_editor):
+    """Готовые списки лежали в MEDIA_ROOT, откуда их отдаёт nginx.
+    Файлы удаляются вместе с заданиями, списки сформируются заново."""
+    ShoppingListJob = apps.get_model('food', 'ShoppingListJob')
+    jobs = ShoppingListJob.objects.exclude(file='')
+    for name in jobs.values_list('file', flat=True).iterator():
+        default_storage.delete(name)
+    jobs.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0014_recipe_snapshot'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='shoppinglistjob',
+            name='file',
+            field=models.FileField(blank=True, storage=food.storage.PrivateStorage(), upload_to='shopping_lists/', verbose_name='Файл'),
+        ),
+        migrations.RunPython(remove_public_files, migrations.RunPython.noop),
+    ]
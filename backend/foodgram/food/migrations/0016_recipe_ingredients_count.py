@@ -0,0 +1,41 @@
+# Generated by Django 3.2 on 2026-10-18 17:47
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_ingredients_count(apps, schema_editor):
+    """Заполняет число ингредиентов рецептов, так же как команда
+    rebuild_pantry_index."""
+    Recipe = apps.get_model('food', 'Recipe')
+    IngredientRecipe = apps.get_model('food', 'IngredientRecipe')
+    Recipe.objects.update(ingredients_count=Coalesce(models.Subquery(
+        IngredientRecipe.objects.filter(recipe=models.OuterRef('pk'))
+        .order_by().values('recipe').annotate(total=models.Count('pk'))
+        .values('total'),
+        output_field=models.IntegerField(),
+    ), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0015_shoppinglistjob_private_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredients_count',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='Число ингредиентов'),
+        ),
+        migrations.AddIndex(
+            model_name='ingredientrecipe',
+            index=models.Index(fields=['ingredient', 'recipe'], name='ingredient_recipe_idx'),
+        ),
+        migrations.RunPython(
+            fill_ingredients_count, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='IngredientIndex',
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2 on 2026-10-18 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('food', '0017_recipeimagejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='snapshot_pending',
+            field=models.BooleanField(default=False, editable=False, verbose_name='Снимок ждёт пересборки'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(snapshot_pending=True), fields=['id'], name='recipe_snapshot_pending_idx'),
+        ),
+    ]
@@ -1,5 +1,9 @@
+from .image_job import RecipeImageJob
 from .ingredient import Ingredient
 from .recipe import Cart, Favorite, IngredientRecipe, Recipe
+from .shopping_list import ShoppingListItem, ShoppingListJob
 from .tag import Tag
+from .timeline import TimelineEntry
 
-__all__ = [Ingredient, Tag, Recipe, IngredientRecipe, Favorite, Cart]
+__all__ = [Ingredient, Tag, Recipe, IngredientRecipe, Favorite, Cart,
+           RecipeImageJob, ShoppingListJob, ShoppingListItem, TimelineEntry]
@@ -0,0 +1,35 @@
+from django.db import models
+
+from .recipe import Recipe
+from .shopping_list import PENDING, STATUSES
+
+
+class RecipeImageJob(models.Model):
+    """Задание на построение уменьшенных копий картинки рецепта."""
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='image_jobs',
+    )
+    status = models.CharField(
+        'Статус',
+        max_length=max([len(status[0]) for status in STATUSES]),
+        choices=STATUSES,
+        default=PENDING,
+        db_index=True,
+    )
+    force = models.BooleanField(
+        'Пересобрать копии', default=False,
+        help_text='Не использовать копии той же картинки у других рецептов.')
+    error = models.TextField('Ошибка', blank=True)
+    created = models.DateTimeField('Создано', auto_now_add=True)
+    started = models.DateTimeField('Начато', null=True, blank=True)
+    finished = models.DateTimeField('Завершено', null=True, blank=True)
+
+    class Meta:
+        ordering = ('created',)
+        verbose_name = 'Задание на копии картинки'
+        verbose_name_plural = 'Задания на копии картинок'
+
+    def __str__(self):
+        return f'{self.recipe_id}: {self.get_status_display()}'
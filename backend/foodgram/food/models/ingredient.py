@@ -11,5 +11,15 @@ class Ingredient(models.Model):
         max_length=200,
         verbose_name='Единица измерения')
 
+    class Meta:
+        constraints = (
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit'),
+                name='unique_ingredient',
+            ),
+        )
+        # GIN-индекс ingredient_name_trgm_idx для поиска по сходству
+        # создаёт миграция food.0006 только на PostgreSQL.
+
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'
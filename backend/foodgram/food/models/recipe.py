@@ -1,10 +1,100 @@
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, TrigramSimilarity)
+from django.core.exceptions import EmptyResultSet
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
 
+from food.storage import ContentAddressedStorage
 from users.models import User
 from .ingredient import Ingredient
 from .tag import Tag
 
+SEARCH_CONFIG = 'russian'
+SEARCH_VECTOR = SearchVector('name', 'text', config=SEARCH_CONFIG)
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Запросы ленты рецептов."""
+
+    def limited_per_author(self, limit):
+        """Оставляет не больше limit последних рецептов каждого автора.
+
+        Номер рецепта внутри автора считается оконной функцией, поэтому
+        выборку стоит заранее ограничить нужными авторами.
+        """
+        ranked = self.annotate(recipe_rank=models.Window(
+            expression=RowNumber(),
+            partition_by=[models.F('author')],
+            order_by=[models.F('pub_date').desc(), models.F('pk').desc()],
+        )).order_by().values('pk', 'recipe_rank')
+        try:
+            sql, params = ranked.query.sql_with_params()
+        except EmptyResultSet:
+            # Выборка заведомо пуста, например author__in=[].
+            return self.none()
+        return self.filter(pk__in=RawSQL(
+            f'SELECT ranked.id FROM ({sql}) ranked '
+            'WHERE ranked.recipe_rank <= %s',
+            (*params, limit),
+        ))
+
+    def search(self, query):
+        """Ищет рецепты по названию, описанию и названиям ингредиентов,
+        сначала самые релевантные.
+
+        На PostgreSQL используются полнотекстовый поиск и pg_trgm с
+        GIN-индексами, на остальных СУБД — icontains. Каждое условие
+        отбирает id рецептов по своему индексу, найденные id
+        объединяются через UNION: OR с коррелированным подзапросом
+        по ингредиентам не дал бы планировщику использовать индексы.
+        """
+        if connections[self.db].vendor != 'postgresql':
+            has_ingredient = models.Exists(IngredientRecipe.objects.filter(
+                recipe=models.OuterRef('pk'),
+                ingredient__name__icontains=query,
+            ))
+            return self.alias(has_ingredient=has_ingredient).annotate(
+                rank=models.Case(
+                    models.When(name__iexact=query, then=4),
+                    models.When(name__istartswith=query, then=3),
+                    models.When(name__icontains=query, then=2),
+                    default=1,
+                    output_field=models.IntegerField(),
+                ),
+            ).filter(
+                models.Q(name__icontains=query)
+                | models.Q(text__icontains=query)
+                | models.Q(has_ingredient=True)
+            ).order_by('-rank', '-pub_date')
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch')
+        # Сначала ингредиенты по ingredient_name_trgm_idx, затем их
+        # рецепты по индексу внешнего ключа.
+        by_ingredient = IngredientRecipe.objects.filter(
+            ingredient__in=Ingredient.objects.filter(
+                name__trigram_similar=query).values('pk'),
+        ).values('recipe')
+        matched = Recipe.objects.alias(search=SEARCH_VECTOR).filter(
+            search=search_query,
+        ).order_by().values('pk').union(
+            Recipe.objects.filter(
+                name__trigram_similar=query).order_by().values('pk'),
+            by_ingredient.order_by(),
+        )
+        return self.filter(pk__in=matched).annotate(
+            rank=(
+                SearchRank(SEARCH_VECTOR, search_query)
+                + TrigramSimilarity('name', query)
+                + models.Case(
+                    models.When(pk__in=by_ingredient, then=0.1),
+                    default=0.0,
+                    output_field=models.FloatField(),
+                )
+            ),
+        ).order_by('-rank', '-pub_date')
+
 
 class Recipe (models.Model):
     author = models.ForeignKey(
@@ -13,7 +103,15 @@ class Recipe (models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='recipe/',
-        blank=True
+        storage=ContentAddressedStorage(),
+        blank=True,
+        db_index=True
+    )
+    image_variants = models.JSONField(
+        'Уменьшенные копии картинки',
+        default=dict,
+        blank=True,
+        editable=False
     )
     text = models.TextField()
     ingredients = models.ManyToManyField(
@@ -33,6 +131,38 @@ class Recipe (models.Model):
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='Время приготовления, мин.'
     )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном', default=0, editable=False)
+    in_carts_count = models.PositiveIntegerField(
+        'В корзинах', default=0, editable=False)
+    ingredients_count = models.PositiveSmallIntegerField(
+        'Число ингредиентов', default=0, editable=False)
+    snapshot = models.JSONField(
+        'Снимок представления',
+        default=dict,
+        blank=True,
+        editable=False
+    )
+    snapshot_generation = models.PositiveIntegerField(
+        'Поколение снимка', default=0, editable=False)
+    snapshot_pending = models.BooleanField(
+        'Снимок ждёт пересборки', default=False, editable=False)
+
+    objects = RecipeQuerySet.as_manager()
+
+    class Meta:
+        ordering = ('-pub_date', '-id')
+        indexes = (
+            models.Index(fields=('-pub_date', '-id'),
+                         name='recipe_pub_date_id_idx'),
+            models.Index(fields=('-favorites_count', '-id'),
+                         name='recipe_favorites_count_idx'),
+            models.Index(fields=('id',),
+                         condition=models.Q(snapshot_pending=True),
+                         name='recipe_snapshot_pending_idx'),
+        )
+        # GIN-индексы recipe_search_vector_idx и recipe_name_trgm_idx
+        # для search создаёт миграция food.0006 только на PostgreSQL.
 
     def __str__(self):
         return self.text
@@ -57,6 +187,11 @@ class IngredientRecipe(models.Model):
 
     class Meta:
         default_related_name = 'ingridients_recipe'
+        # По этому индексу food.pantry ищет рецепты с ингредиентами.
+        indexes = (
+            models.Index(fields=('ingredient', 'recipe'),
+                         name='ingredient_recipe_idx'),
+        )
         constraints = (
             models.UniqueConstraint(
                 fields=('recipe', 'ingredient',),
@@ -0,0 +1,89 @@
+import uuid
+
+from django.db import models
+
+from food.storage import PrivateStorage
+from users.models import User
+from .ingredient import Ingredient
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+STATUSES = (
+    (PENDING, 'В очереди'),
+    (RUNNING, 'Формируется'),
+    (DONE, 'Готов'),
+    (FAILED, 'Ошибка'),
+)
+
+
+class ShoppingListJob(models.Model):
+    """Задание на фоновую отрисовку списка покупок."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+                          editable=False)
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_jobs',
+    )
+    status = models.CharField(
+        'Статус',
+        max_length=max([len(status[0]) for status in STATUSES]),
+        choices=STATUSES,
+        default=PENDING,
+        db_index=True,
+    )
+    digest = models.CharField('Дайджест списка', max_length=64)
+    items = models.JSONField('Ингредиенты')
+    file = models.FileField(
+        'Файл',
+        upload_to='shopping_lists/',
+        storage=PrivateStorage(),
+        blank=True
+    )
+    error = models.TextField('Ошибка', blank=True)
+    created = models.DateTimeField('Создано', auto_now_add=True)
+    started = models.DateTimeField('Начато', null=True, blank=True)
+    finished = models.DateTimeField('Завершено', null=True, blank=True)
+
+    class Meta:
+        ordering = ('created',)
+        verbose_name = 'Задание на список покупок'
+        verbose_name_plural = 'Задания на список покупок'
+
+    def __str__(self):
+        return f'{self.user}: {self.get_status_display()}'
+
+
+class ShoppingListItem(models.Model):
+    """Сумма ингредиента по всем рецептам в корзине пользователя.
+
+    Обновляется при изменении корзины и состава рецептов из неё, поэтому
+    список покупок читается без агрегации.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+    )
+    amount = models.PositiveIntegerField('Количество')
+
+    class Meta:
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списке покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_shopping_list_item',
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} – {self.amount}'
@@ -0,0 +1,66 @@
+"""Поиск рецептов по набору продуктов, которые есть у пользователя.
+
+Обратным индексом служит сама таблица IngredientRecipe с индексом
+(ingredient, recipe). Рецепты с распространёнными продуктами (соль,
+вода) есть почти в каждой строке таблицы, поэтому кандидаты
+ограничены: по каждому продукту берутся PANTRY_CANDIDATES_PER_INGREDIENT
+последних рецептов, каждый такой выбор — короткий проход по индексу.
+Для кандидатов база считает совпадения, делит их на
+Recipe.ingredients_count и сортирует, так что работа не зависит от
+размера каталога.
+"""
+from django.conf import settings
+from django.db.models import Count, F, FloatField
+from django.db.models.functions import Cast, NullIf
+
+from food.counters import count_subquery
+from food.models import IngredientRecipe, Recipe
+
+
+def update_recipe(recipe, ingredient_ids):
+    """Запоминает число ингредиентов рецепта после изменения состава."""
+    recipe.ingredients_count = len(set(ingredient_ids))
+    Recipe.objects.filter(pk=recipe.pk).update(
+        ingredients_count=recipe.ingredients_count)
+
+
+def rebuild():
+    """Пересчитывает число ингредиентов всех рецептов."""
+    return Recipe.objects.update(
+        ingredients_count=count_subquery(IngredientRecipe, 'recipe'))
+
+
+def find_candidates(ingredient_ids):
+    """id последних PANTRY_CANDIDATES_PER_INGREDIENT рецептов с каждым
+    из ингредиентов."""
+    candidates = set()
+    for ingredient_id in ingredient_ids:
+        candidates.update(IngredientRecipe.objects.filter(
+            ingredient_id=ingredient_id,
+        ).order_by('-recipe_id').values_list('recipe_id', flat=True)[
+            :settings.PANTRY_CANDIDATES_PER_INGREDIENT])
+    return candidates
+
+
+def find_recipes(ingredient_ids):
+    """Рецепты-кандидаты (см. find_candidates), в которых есть хотя бы
+    один из ингредиентов.
+
+    Возвращает queryset словарей с ключами recipe (id рецепта), found
+    (найдено ингредиентов) и total (всего ингредиентов): сначала рецепты
+    с наибольшей долей найденных ингредиентов, при равенстве — с
+    наименьшим числом недостающих, затем более новые.
+    """
+    return IngredientRecipe.objects.filter(
+        recipe_id__in=find_candidates(ingredient_ids),
+        ingredient_id__in=ingredient_ids,
+    ).values('recipe').annotate(
+        found=Count('pk'),
+        total=F('recipe__ingredients_count'),
+    ).annotate(
+        coverage=Cast('found', FloatField()) / NullIf('total', 0),
+    ).order_by(
+        F('coverage').desc(nulls_last=True),
+        (F('total') - F('found')).asc(),
+        '-recipe_id',
+    )
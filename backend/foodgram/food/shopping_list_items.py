@@ -0,0 +1,135 @@
+"""Материализованный список покупок.
+
+Для каждой пары (пользователь, ингредиент) хранится сумма количеств по
+рецептам из корзины. Изменения применяются приращениями: добавление
+рецепта в корзину прибавляет его ингредиенты, удаление вычитает,
+изменение состава рецепта переносится в списки всех, у кого он в
+корзине. Изменения одного пользователя выполняются последовательно:
+перед записью блокируется строка пользователя.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Sum
+
+from food.models import Cart, IngredientRecipe, ShoppingListItem
+from users.models import User
+
+
+def lock_users(user_ids):
+    """Блокирует пользователей в порядке id, чтобы избежать
+    взаимоблокировок."""
+    return list(User.objects.select_for_update().filter(
+        pk__in=user_ids).order_by('pk').values_list('pk', flat=True))
+
+
+def apply(deltas):
+    """Применяет приращения {(id пользователя, id ингредиента): delta}."""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    user_ids = {user_id for user_id, _ in deltas}
+    with transaction.atomic():
+        lock_users(user_ids)
+        rows = {
+            (row.user_id, row.ingredient_id): row
+            for row in ShoppingListItem.objects.filter(
+                user_id__in=user_ids,
+                ingredient_id__in={ingredient for _, ingredient in deltas},
+            )
+        }
+        created, changed, removed = [], [], []
+        for (user_id, ingredient_id), delta in deltas.items():
+            row = rows.get((user_id, ingredient_id))
+            if row is None:
+                if delta > 0:
+                    created.append(ShoppingListItem(
+                        user_id=user_id, ingredient_id=ingredient_id,
+                        amount=delta))
+                continue
+            row.amount += delta
+            if row.amount > 0:
+                changed.append(row)
+            else:
+                removed.append(row.pk)
+        if removed:
+            ShoppingListItem.objects.filter(pk__in=removed).delete()
+        ShoppingListItem.objects.bulk_update(changed, ('amount',))
+        ShoppingListItem.objects.bulk_create(created)
+
+
+def change_cart(user_id, recipe_ids, sign):
+    """Добавляет (sign=1) или убирает (sign=-1) рецепты корзины."""
+    deltas = Counter()
+    for ingredient_id, amount in IngredientRecipe.objects.filter(
+            recipe_id__in=recipe_ids).values_list('ingredient_id', 'amount'):
+        deltas[user_id, ingredient_id] += sign * amount
+    apply(deltas)
+
+
+def change_recipe(recipe_id, old_amounts, new_amounts):
+    """Переносит изменение состава рецепта {id ингредиента: количество}
+    в списки покупок пользователей, у которых он в корзине."""
+    changes = {
+        ingredient_id: new_amounts.get(ingredient_id, 0)
+        - old_amounts.get(ingredient_id, 0)
+        for ingredient_id in old_amounts.keys() | new_amounts.keys()
+    }
+    deltas = {}
+    for user_id in Cart.objects.filter(recipe_id=recipe_id).values_list(
+            'user_id', flat=True):
+        for ingredient_id, delta in changes.items():
+            deltas[user_id, ingredient_id] = delta
+    apply(deltas)
+
+
+def get_live_totals(user_ids=None):
+    """Суммы, посчитанные заново по корзинам и составам рецептов."""
+    if user_ids is None:
+        rows = IngredientRecipe.objects.filter(
+            recipe__shopping_cart__isnull=False)
+    else:
+        rows = IngredientRecipe.objects.filter(
+            recipe__shopping_cart__user__in=user_ids)
+    return {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount in rows.values(
+            'recipe__shopping_cart__user', 'ingredient'
+        ).annotate(total=Sum('amount')).values_list(
+            'recipe__shopping_cart__user', 'ingredient', 'total'
+        ).order_by()
+    }
+
+
+def rebuild_user(user_id):
+    """Пересчитывает список покупок пользователя целиком."""
+    with transaction.atomic():
+        lock_users([user_id])
+        ShoppingListItem.objects.filter(user_id=user_id).delete()
+        ShoppingListItem.objects.bulk_create([
+            ShoppingListItem(
+                user_id=user_id, ingredient_id=ingredient_id, amount=amount)
+            for (_, ingredient_id), amount
+            in get_live_totals([user_id]).items()
+        ])
+
+
+def check(fix=False):
+    """Сравнивает таблицу с живой агрегацией и возвращает расхождения
+    {id пользователя: число неверных строк}. С fix=True пересчитывает
+    списки этих пользователей."""
+    live = get_live_totals()
+    stored = {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount
+        in ShoppingListItem.objects.values_list(
+            'user_id', 'ingredient_id', 'amount').iterator()
+    }
+    drift = defaultdict(int)
+    for key in live.keys() | stored.keys():
+        if live.get(key) != stored.get(key):
+            drift[key[0]] += 1
+    if fix:
+        for user_id in drift:
+            rebuild_user(user_id)
+    return dict(drift)
@@ -0,0 +1,62 @@
+"""Хранилища файлов.
+
+ContentAddressedStorage хранит картинки рецептов с адресацией по
+содержимому. Имя файла — хеш его содержимого, поэтому одинаковые
+картинки хранятся один раз, а файл под данным именем никогда не
+меняется. Ссылки на файлы считаются по рецептам: неиспользуемые файлы
+удаляет команда collect_media_garbage.
+
+PrivateStorage хранит файлы пользователей вне MEDIA_ROOT.
+"""
+import hashlib
+import os
+import posixpath
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import cached_property
+
+DIGEST_LENGTH = 32
+
+
+def get_digest(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()[:DIGEST_LENGTH]
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        extension = os.path.splitext(name)[1].lower()
+        name = posixpath.join(
+            posixpath.dirname(name), get_digest(content) + extension)
+        if self.exists(name):
+            # Свежая дата изменения защищает файл от сборщика мусора,
+            # пока ссылающийся на него рецепт ещё не сохранён.
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
+
+
+@deconstructible
+class PrivateStorage(FileSystemStorage):
+    """Хранилище вне MEDIA_ROOT: у файлов нет публичного адреса, они
+    отдаются только через представления API с проверкой владельца."""
+
+    @cached_property
+    def base_location(self):
+        return self._value_or_setting(
+            self._location, settings.PRIVATE_MEDIA_ROOT)
+
+    def url(self, name):
+        raise ValueError('У файлов PrivateStorage нет публичного адреса.')
@@ -0,0 +1,157 @@
+"""Лента подписок: рецепты авторов, на которых подписан пользователь.
+
+Новый рецепт сразу раскладывается по лентам подписчиков (TimelineEntry),
+поэтому лента читается по индексу без author__in по всем подпискам.
+Рецепты авторов, у которых не меньше TIMELINE_FANOUT_LIMIT подписчиков,
+не раскладываются: таких авторов немного, их рецепты добавляются в ленту
+при чтении.
+
+В ленте хранятся последние TIMELINE_SIZE рецептов. Новый рецепт только
+добавляется в ленты, чтобы публикация не считала записи всех подписчиков;
+лишние записи удаляет rebuild_timelines --trim, которую сервис
+timeline_trimmer запускает раз в TIMELINE_TRIM_INTERVAL секунд. Без
+--trim команда пересобирает ленты по подпискам.
+"""
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db import models, transaction
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import RowNumber
+
+from food.models import Recipe, TimelineEntry
+from users.models import Follow
+
+BATCH_SIZE = 1000
+# Порядок ленты, совпадает с индексом timeline_user_pub_date_idx.
+FEED_ORDERING = ('-pub_date', '-recipe_id')
+
+
+def is_pulled(author):
+    """Рецепты автора не раскладываются по лентам, а читаются при
+    запросе ленты."""
+    return author.followers_count >= settings.TIMELINE_FANOUT_LIMIT
+
+
+def make_entries(user_id, rows):
+    return [
+        TimelineEntry(user_id=user_id, recipe_id=recipe_id,
+                      author_id=author_id, pub_date=pub_date)
+        for recipe_id, author_id, pub_date in rows
+    ]
+
+
+def push(recipe):
+    """Добавляет новый рецепт в ленты подписчиков автора."""
+    if is_pulled(recipe.author):
+        return
+    follower_ids = Follow.objects.filter(
+        author_id=recipe.author_id).values_list('user_id', flat=True)
+    TimelineEntry.objects.bulk_create([
+        TimelineEntry(user_id=user_id, recipe_id=recipe.id,
+                      author_id=recipe.author_id, pub_date=recipe.pub_date)
+        for user_id in follower_ids.iterator()
+    ], batch_size=BATCH_SIZE)
+
+
+def follow(user_id, author):
+    """Добавляет в ленту последние рецепты нового автора."""
+    if is_pulled(author):
+        return
+    recipes = Recipe.objects.filter(author=author).order_by(
+        '-pub_date', '-id').values_list('pk', 'author', 'pub_date')
+    TimelineEntry.objects.bulk_create(
+        make_entries(user_id, recipes[:settings.TIMELINE_SIZE]),
+        ignore_conflicts=True)
+    trim([user_id])
+
+
+def unfollow(user_id, author_id):
+    TimelineEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def get_feed(user, recipes=None):
+    """Лента пользователя, сначала новые: словари с id рецепта
+    (recipe_id) и датой публикации (pub_date). Сами рецепты страницы загружает
+    load_recipes.
+
+    Обычно лента листается по индексу TimelineEntry. Если пользователь
+    подписан на авторов, чьи рецепты читаются при запросе, или переданы
+    recipes (рецепты с фильтрами запроса), записи ленты и рецепты таких
+    авторов отбираются из рецептов.
+    """
+    entries = TimelineEntry.objects.filter(user=user)
+    pulled_ids = list(Follow.objects.filter(
+        user=user,
+        author__followers_count__gte=settings.TIMELINE_FANOUT_LIMIT,
+    ).values_list('author', flat=True))
+    if recipes is None and not pulled_ids:
+        return entries.values('recipe_id', 'pub_date').order_by(*FEED_ORDERING)
+    if recipes is None:
+        recipes = Recipe.objects.order_by('-pub_date', '-pk')
+    return recipes.filter(
+        models.Q(pk__in=entries.values('recipe'))
+        | models.Q(author_id__in=pulled_ids)
+    ).values('pub_date', recipe_id=models.F('pk'))
+
+
+def load_recipes(rows):
+    """Рецепты страницы ленты в порядке страницы."""
+    recipes = Recipe.objects.in_bulk([row['recipe_id'] for row in rows])
+    return [recipes[row['recipe_id']] for row in rows
+            if row['recipe_id'] in recipes]
+
+
+def rebuild_user(user_id):
+    """Пересобирает ленту пользователя по его подпискам."""
+    recipes = Recipe.objects.filter(author__in=Follow.objects.filter(
+        user=user_id,
+        author__followers_count__lt=settings.TIMELINE_FANOUT_LIMIT,
+    ).values('author')).order_by('-pub_date', '-id').values_list(
+        'pk', 'author', 'pub_date')
+    with transaction.atomic():
+        TimelineEntry.objects.filter(user_id=user_id).delete()
+        TimelineEntry.objects.bulk_create(
+            make_entries(user_id, recipes[:settings.TIMELINE_SIZE]),
+            batch_size=BATCH_SIZE)
+
+
+def rebuild(user_ids=None):
+    """Пересобирает ленты пользователей, по умолчанию — все. Возвращает
+    число пересобранных лент."""
+    if user_ids is None:
+        TimelineEntry.objects.exclude(
+            user__in=Follow.objects.values('user')).delete()
+        user_ids = Follow.objects.values_list(
+            'user', flat=True).distinct().order_by().iterator()
+    count = 0
+    for user_id in user_ids:
+        rebuild_user(user_id)
+        count += 1
+    return count
+
+
+def trim(user_ids=None):
+    """Удаляет из лент пользователей user_ids (по умолчанию — всех)
+    записи старше последних TIMELINE_SIZE, возвращает число удалённых
+    записей.
+
+    Номер записи внутри ленты считается оконной функцией.
+    """
+    entries = TimelineEntry.objects.all()
+    if user_ids is not None:
+        entries = entries.filter(user__in=user_ids)
+    ranked = entries.annotate(entry_rank=models.Window(
+        expression=RowNumber(),
+        partition_by=[models.F('user')],
+        order_by=[models.F('pub_date').desc(), models.F('recipe').desc()],
+    )).order_by().values('pk', 'entry_rank')
+    try:
+        sql, params = ranked.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    deleted, _ = TimelineEntry.objects.filter(pk__in=RawSQL(
+        f'SELECT ranked.id FROM ({sql}) ranked '
+        'WHERE ranked.entry_rank > %s',
+        (*params, settings.TIMELINE_SIZE),
+    )).delete()
+    return deleted
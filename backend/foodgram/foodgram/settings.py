@@ -21,6 +21,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'corsheaders',
@@ -30,10 +31,10 @@ INSTALLED_APPS = [
     'webcolors',
     'django_filters',
     'food',
-    'weasyprint',
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -44,6 +45,9 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+if os.getenv('METRICS_ENABLED', default='1') != '1':
+    MIDDLEWARE.remove('api.metrics.MetricsMiddleware')
+
 ROOT_URLCONF = 'foodgram.urls'
 
 REST_FRAMEWORK = {
@@ -83,10 +87,32 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', default='postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', default='postgres'),
         'HOST': os.getenv('DB_HOST', default='db'),
-        'PORT': os.getenv('DB_PORT', default='5432')
+        'PORT': os.getenv('DB_PORT', default='5432'),
+        # Соединение переиспользуется запросами одного потока gunicorn.
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
     }
 }
 
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', default='/var/tmp/foodgram'),
+    },
+    'redis': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', default='redis://redis:6379/0'),
+    },
+}
+
+CACHES = {
+    'default': CACHE_BACKENDS[os.getenv('CACHE_BACKEND', default='locmem')],
+}
+
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', default=60))
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -117,6 +143,15 @@ STATIC_URL = '/static/'
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Файлы пользователей, которые отдаются только через API, не nginx.
+PRIVATE_MEDIA_ROOT = os.getenv(
+    'PRIVATE_MEDIA_ROOT', default=os.path.join(BASE_DIR, 'private'))
+
+RECIPE_IMAGE_MAX_SIZE = int(os.getenv('RECIPE_IMAGE_MAX_SIZE', default=10 * 1024 * 1024))
+RECIPE_IMAGE_WIDTHS = (320, 640, 1280)
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', default=2))
+RECIPE_IMAGE_JOB_TIMEOUT = 10 * 60
+RECIPE_IMAGE_JOB_TTL = 24 * 60 * 60
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'users.User'
@@ -136,3 +171,29 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_URLS_REGEX = r'^/api/.*$'
+
+SHOPPING_LIST_WORKERS = int(os.getenv('SHOPPING_LIST_WORKERS', default=2))
+SHOPPING_LIST_JOB_TIMEOUT = 10 * 60
+SHOPPING_LIST_JOB_TTL = 24 * 60 * 60
+SHOPPING_LIST_RETRY_AFTER = 2
+
+BULK_RECIPES_LIMIT = 100
+
+TIMELINE_SIZE = 1000
+TIMELINE_FANOUT_LIMIT = int(os.getenv('TIMELINE_FANOUT_LIMIT', default=5000))
+TIMELINE_TRIM_INTERVAL = int(
+    os.getenv('TIMELINE_TRIM_INTERVAL', default=60 * 60))
+
+PANTRY_MAX_INGREDIENTS = 50
+PANTRY_CANDIDATES_PER_INGREDIENT = 1000
+
+INGREDIENT_INDEX_TTL = 5 * 60
+
+USER_FLAGS_CACHE_SIZE = int(os.getenv('USER_FLAGS_CACHE_SIZE', default=10000))
+USER_FLAGS_TTL = int(os.getenv('USER_FLAGS_TTL', default=60))
+INGREDIENT_AUTOCOMPLETE_LIMIT = 10
+INGREDIENT_AUTOCOMPLETE_MAX_LIMIT = 50
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', default='')
+SLOW_REQUEST_THRESHOLD = int(os.getenv('SLOW_REQUEST_THRESHOLD', default=500))
+SLOW_REQUEST_LOG_INTERVAL = 60
@@ -0,0 +1,19 @@
+"""Настройки gunicorn, значения можно переопределить переменными
+окружения.
+
+Django 3.2 и DRF выполняют запросы синхронно, поэтому одновременно
+обрабатывается workers × threads запросов. Каждый поток держит своё
+постоянное соединение с PostgreSQL (CONN_MAX_AGE), то есть число потоков —
+это размер пула соединений процесса.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', default='0:8000')
+workers = int(os.getenv(
+    'GUNICORN_WORKERS', default=multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', default=1))
+# sync — процесс на запрос, gthread — threads потоков в процессе.
+worker_class = os.getenv(
+    'GUNICORN_WORKER_CLASS', default='gthread' if threads > 1 else 'sync')
+timeout = int(os.getenv('GUNICORN_TIMEOUT', default=30))
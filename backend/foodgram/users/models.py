@@ -33,6 +33,10 @@ class User(AbstractUser):
                             max_length=max([len(role[0]) for role in ROLES]),
                             choices=ROLES,
                             default=USER)
+    recipes_count = models.PositiveIntegerField(
+        'Число рецептов', default=0, editable=False)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0, editable=False)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']